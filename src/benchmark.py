@@ -0,0 +1,220 @@
+"""
+Benchmark of asano_algorithm on generated scenes of growing size.
+
+Every generator takes the wanted number of vertices and a seed and gives
+the polygons and a viewpoint outside all of them. A run times every phase
+of one query (scene preprocessing, initial status, event sorting, the
+sweep loop, and the whole query), fits the exponent of each phase's time
+against the number of vertices, measures the peak memory of the query
+and can save everything as JSON to compare runs across commits:
+
+    python benchmark.py --sizes 100 1000 10000 --output bench.json
+"""
+import json
+import math
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+
+from visual_objects import Point, Polygon
+from tree import Tree
+from scene import Scene
+import visibility
+from visibility import asano_algorithm, get_initial_ray
+
+
+def squares(x, y, size):
+    return Polygon([Point(x, y), Point(x + size, y), Point(x + size, y + size), Point(x, y + size)])
+
+
+def grid_scene(n, seed=0):
+    # squares in rows and columns, as Canvas.generate_auto draws them
+    side = max(1, math.ceil(math.sqrt(n / 4)))
+    polygons = [squares(20 + 50 * i, 20 + 50 * j, 10) for i in range(side) for j in range(side)]
+    middle = 20 + 50 * (side // 2) - 14.5
+    return polygons, Point(middle, middle + 0.3)
+
+
+def cell_polygons(n, seed, star=False):
+    # one polygon per 40 x 40 cell, its vertices at sorted random angles
+    # (a star pulls every other vertex towards the centre)
+    rnd = random.Random(seed)
+    polygons, count = [], 0
+    side = max(1, math.ceil(math.sqrt(n / 6)))
+    for gx in range(side):
+        for gy in range(side):
+            if count >= n:
+                break
+            cx, cy = 40 * gx + rnd.uniform(15, 25), 40 * gy + rnd.uniform(15, 25)
+            corners = 2 * rnd.randint(3, 6) if star else rnd.randint(3, 8)
+            angles = sorted(rnd.uniform(0, 2 * math.pi) for _ in range(corners))
+            radii = [rnd.uniform(3, 7) if star and k % 2 else rnd.uniform(8, 12) for k in range(corners)]
+            polygons.append(Polygon([Point(cx + r * math.cos(a), cy + r * math.sin(a))
+                                     for a, r in zip(angles, radii)]))
+            count += len(angles)
+    corner = 40 * (side // 2) + 0.5
+    return polygons, Point(corner, corner + 0.2)
+
+
+def convex_scene(n, seed=0):
+    return cell_polygons(n, seed)
+
+
+def nonconvex_scene(n, seed=0):
+    return cell_polygons(n, seed, star=True)
+
+
+def comb_scene(n, seed=0):
+    # one polygon with n / 4 teeth, seen from above: the viewpoint looks
+    # into every gap between them
+    teeth = max(2, n // 4)
+    width, period, height = 1.0, 2.0, 50.0
+    end = (teeth - 1) * period + width
+    points = [Point(0, -10), Point(end, -10)]
+    for i in reversed(range(teeth)):
+        left, right = i * period, i * period + width
+        if i < teeth - 1:
+            points.append(Point(right, 0))
+        points += [Point(right, height), Point(left, height)]
+        if i > 0:
+            points.append(Point(left, 0))
+    return [Polygon(points)], Point(end / 2 + 0.3, 2 * height)
+
+
+def spiral_scene(n, seed=0):
+    # a thin spiral band around the viewpoint: deep nesting of the status
+    steps = max(8, n // 2)
+    turns = max(2, steps // 200)
+    outer, inner = [], []
+    for k in range(steps):
+        angle = 2 * math.pi * turns * k / (steps - 1)
+        radius = 20 + 10 * angle / (2 * math.pi)
+        outer.append(Point(radius * math.cos(angle), radius * math.sin(angle)))
+        inner.append(Point((radius - 4) * math.cos(angle), (radius - 4) * math.sin(angle)))
+    return [Polygon(outer + inner[::-1])], Point(0.3, 0.1)
+
+
+def corridor_scene(n, seed=0):
+    # long thin walls in rows with doors between them, in a brick pattern
+    side = max(1, math.ceil(math.sqrt(n / 4)))
+    polygons = []
+    for row in range(side):
+        shift = 0 if row % 2 else 100
+        for col in range(side):
+            x, y = 205 * col + shift, 10 * row
+            polygons.append(Polygon([Point(x, y), Point(x + 200, y), Point(x + 200, y + 1), Point(x, y + 1)]))
+    return polygons, Point(205 * (side // 2) + 50.3, 10 * (side // 2) + 5.2)
+
+
+GENERATORS = {
+    "grid": grid_scene,
+    "convex": convex_scene,
+    "nonconvex": nonconvex_scene,
+    "comb": comb_scene,
+    "spiral": spiral_scene,
+    "corridors": corridor_scene,
+}
+
+PHASES = ("scene", "status", "events", "loop", "total")
+
+
+def best_of(repeat, function, *args):
+    best, result = math.inf, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def measure(polygons: [Polygon], point: Point, repeat=3) -> dict:
+    times = {}
+    times["scene"], scene = best_of(repeat, Scene, polygons, [point])
+    ray = get_initial_ray(point, scene)
+    # through the module, so a metrics recording times these phases too
+    times["status"], _ = best_of(repeat, visibility.initial_status, ray, scene)
+    times["events"], events = best_of(repeat, visibility.sort_events, point, ray.end, scene)
+    sweep, output = best_of(repeat, visibility.sweep_scene, scene, ray, None, Tree, events)
+    times["loop"] = max(sweep - times["status"], 0.0)
+    times["total"], _ = best_of(repeat, asano_algorithm, point, polygons)
+
+    tracemalloc.start()
+    asano_algorithm(point, polygons)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "vertices": sum(len(polygon.points) for polygon in polygons),
+        "output": len(output),
+        "seconds": times,
+        "peak_bytes": peak,
+    }
+
+
+def fit_exponent(sizes, seconds):
+    # slope of log(time) over log(n); None with fewer than two usable sizes
+    pairs = [(n, t) for n, t in zip(sizes, seconds) if t > 0]
+    if len(pairs) < 2:
+        return None
+    x, y = np.log([n for n, _ in pairs]), np.log([t for _, t in pairs])
+    return float(np.polyfit(x, y, 1)[0])
+
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(generators=tuple(GENERATORS), sizes=(100, 1000, 10000, 100000), repeat=3, seed=0, log=print) -> dict:
+    results, fits = [], {}
+    for name in generators:
+        rows = []
+        for n in sizes:
+            polygons, point = GENERATORS[name](n, seed)
+            row = {"generator": name, "n": n, **measure(polygons, point, repeat)}
+            rows.append(row)
+            if log:
+                phases = " ".join(f"{phase}={row['seconds'][phase] * 1000:.1f}ms" for phase in PHASES)
+                log(f"{name:10s} vertices={row['vertices']:7d} output={row['output']:6d} {phases} "
+                    f"peak={row['peak_bytes'] / 2 ** 20:.1f}MiB")
+        fits[name] = {
+            phase: fit_exponent([row["vertices"] for row in rows], [row["seconds"][phase] for row in rows])
+            for phase in PHASES
+        }
+        if log:
+            log(f"{name:10s} exponents " + " ".join(
+                f"{phase}={exponent:.2f}" for phase, exponent in fits[name].items() if exponent is not None))
+        results += rows
+
+    return {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "repeat": repeat,
+        "seed": seed,
+        "results": results,
+        "exponents": fits,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Time asano_algorithm on generated scenes")
+    parser.add_argument("--generators", nargs="+", choices=list(GENERATORS), default=list(GENERATORS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100, 1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON file to save the results to")
+    args = parser.parse_args()
+
+    report = run(args.generators, args.sizes, args.repeat, args.seed)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
@@ -0,0 +1,142 @@
+import sys
+from collections import OrderedDict
+
+from visual_objects import Point, Edge
+from tree import Tree
+from scene import Scene, invalidated
+from visibility import asano_algorithm
+
+
+def result_bytes(edges: [Edge]) -> int:
+    # rough size of a visibility polygon: the list, its edges and their points
+    points = {id(point): point for edge in edges for point in (edge.a, edge.b)}
+    size = sys.getsizeof(edges) + sum(sys.getsizeof(edge) for edge in edges)
+    return size + sum(sys.getsizeof(point) + 2 * sys.getsizeof(point.x) for point in points.values())
+
+
+class VisibilityCache:
+    """
+    Least recently used visibility polygons of one scene. A query is keyed
+    by the scene version and the viewpoint snapped to a `tolerance` grid
+    (Point's own hash is exact while its == has eps slack, so points are
+    never used as keys), together with max_distance and fov. The oldest
+    entries go when there are more than `max_entries` of them or they take
+    more than `max_bytes`.
+
+    Pass the box returned by a Scene edit to `edited`: the polygons it
+    touches are dropped and the rest carry over to the new version. After
+    an edit the cache didn't hear of every entry is dropped.
+    """
+
+    def __init__(self, scene: Scene, tolerance=1e-6, max_entries=1024, max_bytes=None, tree_class=Tree):
+        if tolerance <= 0:
+            raise ValueError(f"Tolerance must be positive, got {tolerance}")
+        self.scene = scene
+        self.tolerance = tolerance
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.tree_class = tree_class
+
+        self.entries = OrderedDict()
+        self.version = scene.version
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def key(self, point: Point, max_distance=None, fov=None):
+        cell = round(point.x / self.tolerance), round(point.y / self.tolerance)
+        return self.scene.version, cell, max_distance, None if fov is None else tuple(fov)
+
+    def query(self, point: Point, max_distance=None, fov=None) -> [Edge]:
+        if self.scene.version != self.version:
+            self.drop(list(self.entries))
+            self.version = self.scene.version
+
+        key = self.key(point, max_distance, fov)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return list(entry[0])
+
+        self.misses += 1
+        edges = asano_algorithm(point, self.scene, self.tree_class, max_distance, fov)
+        size = result_bytes(edges)
+        if self.max_bytes is None or size <= self.max_bytes:
+            self.entries[key] = edges, size
+            self.bytes += size
+            self.evict()
+        return list(edges)
+
+    def edited(self, box):
+        # polygons meeting the edited box are stale, the others still hold
+        current = {key: edges for key, (edges, _) in self.entries.items() if key[0] == self.version}
+        self.drop(set(self.entries) - set(current) | set(invalidated(current, box)))
+        self.entries = OrderedDict(
+            ((self.scene.version,) + key[1:], entry) for key, entry in self.entries.items()
+        )
+        self.version = self.scene.version
+
+    def drop(self, keys):
+        for key in keys:
+            self.bytes -= self.entries.pop(key)[1]
+            self.invalidations += 1
+
+    def evict(self):
+        while self.entries and (
+            len(self.entries) > self.max_entries
+            or (self.max_bytes is not None and self.bytes > self.max_bytes)
+        ):
+            _, (_, size) = self.entries.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+
+    def clear(self):
+        self.drop(list(self.entries))
+
+    def stats(self) -> dict:
+        queries = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / queries if queries else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def __len__(self):
+        return len(self.entries)
+
+
+if __name__ == "__main__":
+    # guards standing still and agents snapped to a navigation grid
+    import random
+    import time
+
+    from visual_objects import Polygon
+
+    polygons = []
+    for i in range(20, 1000, 50):
+        for j in range(20, 1000, 50):
+            polygons.append(Polygon([
+                Point(i, j),
+                Point(i + 10, j),
+                Point(i + 10, j + 10),
+                Point(i, j + 10),
+            ]))
+    scene = Scene(polygons)
+    cache = VisibilityCache(scene, tolerance=1.0, max_entries=256)
+
+    random.seed(1)
+    nodes = [Point(45.5 + 50 * random.randrange(19), 45.5 + 50 * random.randrange(19)) for _ in range(100)]
+    queries = [random.choice(nodes) for _ in range(1000)]
+
+    start = time.perf_counter()
+    for point in queries:
+        cache.query(point)
+    print(f"{len(queries)} queries in {time.perf_counter() - start:.3f}s", cache.stats())
+
+    box = scene.move_polygon(polygons[200], 5, 5)
+    cache.edited(box)
+    print("after moving one obstacle", cache.stats())
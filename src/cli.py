@@ -0,0 +1,200 @@
+"""
+Visibility polygons of a stream of viewpoints, from the command line:
+
+    python cli.py --scene map.json < viewpoints.jsonl > polygons.jsonl
+    python cli.py --scene map.json --input points.csv --workers 8 | gzip > out.csv.gz
+
+The scene is loaded once, from JSON or a binary scene file (scenefile.py).
+Viewpoints are read one line at a time, as
+JSONL ([x, y] or {"x": .., "y": .., "id": ..} or {"point": [x, y], ...})
+or CSV (x,y[,id], with an optional header), and a polygon is written per
+line in input order:
+
+    jsonl: {"id": .., "point": [x, y], "vertices": [[x, y], ...], "visible": [...]}
+    csv:   id,x,y,polygon,visible,error  (polygon as WKT, visible as 0/1 per side)
+
+A line that can't be parsed or queried gets a record with its error.
+Viewpoints go to the workers in chunks and at most `prefetch` chunks per
+worker are in flight, so memory stays bounded however long the stream.
+"""
+import csv
+import io
+import json
+import os
+import sys
+from collections import deque
+
+from visual_objects import Point, Polygon
+from scene import Scene
+from visibility import visibility_polygon
+from parallel import get_context, chunks
+from scenefile import is_scene_file, load_scene
+
+FORMATS = ("jsonl", "csv")
+
+# the scene and query options of a worker process, set once by its initializer
+worker = None
+
+
+def start_worker(scene: Scene, max_distance, fov):
+    global worker
+    worker = scene, max_distance, fov
+
+
+def load_polygons(path: str) -> [Polygon]:
+    # JSON: a list of polygons, or {"polygons": [...]}, each a list of [x, y]
+    with open(path) as file:
+        data = json.load(file)
+    if isinstance(data, dict):
+        data = data["polygons"]
+    return [Polygon([Point(float(x), float(y)) for x, y in points]) for points in data]
+
+
+def parse_jsonl(line: str):
+    value = json.loads(line)
+    if isinstance(value, list):
+        return float(value[0]), float(value[1]), None
+    if "point" in value:
+        x, y = value["point"]
+    else:
+        x, y = value["x"], value["y"]
+    return float(x), float(y), value.get("id")
+
+
+def read_points(stream, fmt: str):
+    """
+    Yields (x, y, id, error) for every input line, blank lines skipped: a
+    line that can't be parsed gives x = y = None and the error.
+    """
+    if fmt == "jsonl":
+        for number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                yield (*parse_jsonl(line), None)
+            except (ValueError, KeyError, TypeError, IndexError) as error:
+                yield None, None, None, f"line {number}: {type(error).__name__}: {error}"
+        return
+
+    for number, row in enumerate(csv.reader(stream), 1):
+        if not row or not "".join(row).strip():
+            continue
+        try:
+            x, y = float(row[0]), float(row[1])
+        except (ValueError, IndexError) as error:
+            if number == 1:
+                continue
+            yield None, None, None, f"line {number}: {type(error).__name__}: {error}"
+            continue
+        yield x, y, row[2] if len(row) > 2 else None, None
+
+
+def format_record(fmt: str, x, y, id, vertices=None, visible=None, error=None) -> str:
+    if fmt == "jsonl":
+        record = {} if id is None else {"id": id}
+        record["point"] = None if x is None else [x, y]
+        if error is None:
+            record["vertices"], record["visible"] = vertices, visible
+        else:
+            record["error"] = error
+        return json.dumps(record, separators=(",", ":")) + "\n"
+
+    polygon = flags = ""
+    if error is None:
+        ring = vertices + vertices[:1]
+        polygon = "POLYGON((" + ",".join(f"{vx!r} {vy!r}" for vx, vy in ring) + "))"
+        flags = "".join("1" if flag else "0" for flag in visible)
+    row = io.StringIO()
+    csv.writer(row, lineterminator="\n").writerow(
+        ["" if id is None else id, "" if x is None else repr(x), "" if y is None else repr(y), polygon, flags, error or ""]
+    )
+    return row.getvalue()
+
+
+def run_chunk(records: [tuple], fmt: str) -> str:
+    # the output text of a chunk of viewpoints, made where they are computed
+    scene, max_distance, fov = worker
+    lines = []
+    for x, y, id, error in records:
+        if error is None:
+            try:
+                vertices, visible = visibility_polygon(Point(x, y), scene, max_distance=max_distance, fov=fov)
+                lines.append(format_record(fmt, x, y, id, vertices.tolist(), visible.tolist()))
+                continue
+            except Exception as failure:
+                error = f"{type(failure).__name__}: {failure}"
+        lines.append(format_record(fmt, x, y, id, error=error))
+    return "".join(lines)
+
+
+def stream_polygons(records, scene: Scene, fmt="jsonl", workers=1, chunk_size=256, prefetch=2,
+                    max_distance=None, fov=None):
+    """
+    Yields the output text of the records chunk by chunk, in input order.
+    Reading stops while `workers * prefetch` chunks are being computed.
+    """
+    if workers == 1:
+        start_worker(scene, max_distance, fov)
+        for chunk in chunks(records, chunk_size):
+            yield run_chunk(chunk, fmt)
+        return
+
+    with get_context().Pool(workers, initializer=start_worker, initargs=(scene, max_distance, fov)) as pool:
+        pending = deque()
+        for chunk in chunks(records, chunk_size):
+            pending.append(pool.apply_async(run_chunk, (chunk, fmt)))
+            if len(pending) >= workers * prefetch:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def guess_format(path: str) -> str:
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Visibility polygons of a stream of viewpoints")
+    parser.add_argument("--scene", required=True, help="JSON or binary scene file of the obstacle polygons")
+    parser.add_argument("--weld", type=float, default=0.0, help="grid tolerance merging a binary scene's vertices")
+    parser.add_argument("--input", default="-", help="viewpoints file, - for stdin")
+    parser.add_argument("--output", default="-", help="polygons file, - for stdout")
+    parser.add_argument("--format", choices=FORMATS, help="input format, by default from the file name or jsonl")
+    parser.add_argument("--output-format", choices=FORMATS, help="output format, by default the input format")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--prefetch", type=int, default=2, help="chunks in flight per worker")
+    parser.add_argument("--max-distance", type=float)
+    parser.add_argument("--fov", type=float, nargs=2, metavar=("HEADING", "ANGLE"), help="cone of vision, radians")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or guess_format(args.input)
+    output_format = args.output_format or fmt
+    if is_scene_file(args.scene):
+        scene = load_scene(args.scene, args.weld)
+    else:
+        scene = Scene(load_polygons(args.scene))
+
+    source = sys.stdin if args.input == "-" else open(args.input, newline="")
+    target = sys.stdout if args.output == "-" else open(args.output, "w", newline="")
+    try:
+        if output_format == "csv":
+            target.write("id,x,y,polygon,visible,error\n")
+        for text in stream_polygons(read_points(source, fmt), scene, output_format, args.workers,
+                                    args.chunk_size, args.prefetch, args.max_distance, args.fov):
+            target.write(text)
+        target.flush()
+    except BrokenPipeError:
+        # the reader (head, a closed pipe) wants no more: keep the exit quiet
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+
+
+if __name__ == "__main__":
+    main()
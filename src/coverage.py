@@ -0,0 +1,258 @@
+"""
+Coverage of a scene by a set of guards (the art gallery problem): the
+union of their visibility polygons on a raster grid, the covered area and
+the uncovered pockets of free space.
+
+    with Coverage(scene, resolution=2.0, workers=4) as coverage:
+        coverage.add(guards)
+        coverage.stats(), coverage.pockets()
+"""
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from visual_objects import Point
+from tree import Tree
+from scene import Scene
+from visibility import visibility_polygon
+from raster import Rasterizer
+
+# the scene of a worker process, set once by its initializer
+worker = None
+
+
+def start_worker(scene: Scene, tree_class, max_distance):
+    global worker
+    worker = scene, tree_class, max_distance
+
+
+def guard_ring(point) -> np.ndarray:
+    scene, tree_class, max_distance = worker
+    return visibility_polygon(Point(*point), scene, tree_class, max_distance)[0]
+
+
+def components(mask: np.ndarray):
+    """
+    4-connected components of a boolean grid, found over its runs of True
+    along the rows. Returns the runs (row, first column, last column + 1)
+    and the component of every run, numbered from 0, and their count.
+    """
+    rows, columns = mask.shape
+    padded = np.zeros((rows, columns + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    steps = np.diff(padded, axis=1)
+    row, first = np.nonzero(steps == 1)
+    _, last = np.nonzero(steps == -1)
+
+    # runs of consecutive rows overlap when they share a column; in row
+    # major order the runs of the row above overlapping a run are a range
+    width = columns + 1
+    starts, ends = row * width + first, row * width + last
+    low = np.searchsorted(ends, (row - 1) * width + first, side="right")
+    high = np.searchsorted(starts, (row - 1) * width + last, side="left")
+    counts = np.maximum(high - low, 0)
+    below = np.repeat(np.arange(len(row)), counts)
+    above = np.repeat(low, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    parent = list(range(len(row)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a, b in zip(above.tolist(), below.tolist()):
+        a, b = find(a), find(b)
+        if a != b:
+            parent[max(a, b)] = min(a, b)
+    roots = np.array([find(i) for i in range(len(row))], dtype=np.intp)
+    labels, component = np.unique(roots, return_inverse=True)
+    return (row, first, last), component, len(labels)
+
+
+class Coverage:
+    """
+    Union of the visibility polygons of guards on a grid of square pixels
+    of side `resolution` over the scene's box (or `box`): counts[j, i] is
+    the number of guards that see pixel (j, i), as Rasterizer places it,
+    and `blocked` marks the pixels inside obstacles.
+
+    The polygons of new guards are computed in `workers` processes, each
+    holding its own copy of the scene. Adding or removing a guard fills
+    only its own polygon into the counts, with +1 or -1. After an edit of
+    the scene every polygon is computed again on the next change.
+    """
+
+    def __init__(self, scene: Scene, resolution=1.0, workers=1, tree_class=Tree, max_distance=None, box=None):
+        self.scene = scene
+        self.resolution = resolution
+        self.workers = workers
+        self.tree_class = tree_class
+        self.max_distance = max_distance
+
+        min_x, min_y, max_x, max_y = box if box is not None else scene.box
+        shape = max(1, math.ceil((max_y - min_y) / resolution)), max(1, math.ceil((max_x - min_x) / resolution))
+        self.origin = min_x, min_y
+        self.counts = np.zeros(shape, dtype=np.int32)
+        self.blocked = np.zeros(shape, dtype=bool)
+        self.rasterizer = Rasterizer(self.counts, self.origin, resolution)
+
+        self.guards = {}
+        self.version = None
+        self.executor = None
+        self.rasterize_obstacles()
+
+    def rasterize_obstacles(self):
+        self.blocked[...] = False
+        rasterizer = Rasterizer(self.blocked, self.origin, self.resolution)
+        for polygon in self.scene.outlines:
+            rasterizer.fill([p.coordinates for p in polygon.points], "or", True)
+        self.version = self.scene.version
+
+    def rings(self, points: [tuple]) -> [np.ndarray]:
+        # visibility polygons of guards, in parallel when there are workers
+        if self.workers == 1 or len(points) < 2:
+            return [visibility_polygon(Point(*p), self.scene, self.tree_class, self.max_distance)[0] for p in points]
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                self.workers, initializer=start_worker, initargs=(self.scene, self.tree_class, self.max_distance)
+            )
+        chunk = max(1, len(points) // (4 * self.workers))
+        return list(self.executor.map(guard_ring, points, chunksize=chunk))
+
+    def refresh(self):
+        # the scene was edited: obstacles and every guard's polygon are stale
+        if self.scene.version == self.version:
+            return
+        self.close()
+        self.rasterize_obstacles()
+        self.counts[...] = 0
+        points = list(self.guards)
+        self.guards = dict(zip(points, self.rings(points)))
+        for ring in self.guards.values():
+            self.rasterizer.fill(ring, "add", 1)
+
+    def add(self, guards: [Point]):
+        self.refresh()
+        points = [(guard.x, guard.y) for guard in guards]
+        for point in points:
+            if point in self.guards:
+                raise ValueError(f"Guard {point} is already placed")
+        if len(set(points)) != len(points):
+            raise ValueError("Guards to add must be distinct")
+        for point, ring in zip(points, self.rings(points)):
+            self.guards[point] = ring
+            self.rasterizer.fill(ring, "add", 1)
+
+    def remove(self, guards: [Point]):
+        self.refresh()
+        for guard in guards:
+            ring = self.guards.pop((guard.x, guard.y))
+            self.rasterizer.fill(ring, "add", -1)
+
+    def __len__(self):
+        return len(self.guards)
+
+    @property
+    def covered(self) -> np.ndarray:
+        return (self.counts > 0) & ~self.blocked
+
+    @property
+    def uncovered(self) -> np.ndarray:
+        return (self.counts == 0) & ~self.blocked
+
+    def stats(self) -> dict:
+        pixel = self.resolution ** 2
+        free = int(np.count_nonzero(~self.blocked)) * pixel
+        covered = int(np.count_nonzero(self.covered)) * pixel
+        return {
+            "guards": len(self.guards),
+            "free_area": free,
+            "covered_area": covered,
+            "uncovered_area": free - covered,
+            "covered_fraction": covered / free if free else 0.0,
+        }
+
+    def pockets(self, min_area=0.0) -> [dict]:
+        """
+        Connected uncovered parts of the free space, largest first, each
+        with its area, bounding box and centroid in scene coordinates.
+        """
+        (row, first, last), component, count = components(self.uncovered)
+        length = last - first
+        pixels = np.bincount(component, weights=length, minlength=count)
+        sum_x = np.bincount(component, weights=length * (first + last) / 2, minlength=count)
+        sum_y = np.bincount(component, weights=length * (row + 0.5), minlength=count)
+        low_i, low_j = np.full(count, np.iinfo(np.intp).max), np.full(count, np.iinfo(np.intp).max)
+        high_i, high_j = np.zeros(count, dtype=np.intp), np.zeros(count, dtype=np.intp)
+        np.minimum.at(low_i, component, first)
+        np.minimum.at(low_j, component, row)
+        np.maximum.at(high_i, component, last)
+        np.maximum.at(high_j, component, row + 1)
+
+        (ox, oy), size = self.origin, self.resolution
+        result = []
+        for k in np.argsort(-pixels, kind="stable").tolist():
+            area = float(pixels[k]) * size ** 2
+            if area < min_area:
+                break
+            result.append({
+                "area": area,
+                "box": (ox + int(low_i[k]) * size, oy + int(low_j[k]) * size,
+                        ox + int(high_i[k]) * size, oy + int(high_j[k]) * size),
+                "centroid": (ox + float(sum_x[k] / pixels[k]) * size, oy + float(sum_y[k] / pixels[k]) * size),
+            })
+        return result
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    from visual_objects import Polygon
+
+    polygons = []
+    for i in range(20, 1000, 50):
+        for j in range(20, 1000, 50):
+            polygons.append(Polygon([
+                Point(i, j),
+                Point(i + 10, j),
+                Point(i + 10, j + 10),
+                Point(i, j + 10),
+            ]))
+    scene = Scene(polygons)
+
+    random.seed(1)
+    guards = [Point(45.5 + 50 * random.randrange(19), 45.5 + 50 * random.randrange(19)) for _ in range(40)]
+    guards = list({(g.x, g.y): g for g in guards}.values())
+
+    for workers in (1, 4):
+        with Coverage(scene, resolution=2.0, workers=workers) as coverage:
+            start = time.perf_counter()
+            coverage.add(guards)
+            print(f"workers={workers}: {len(guards)} guards in {time.perf_counter() - start:.3f}s")
+
+    coverage = Coverage(scene, resolution=2.0, max_distance=120)
+    coverage.add(guards)
+    print(coverage.stats())
+    pockets = coverage.pockets(min_area=20)
+    print(f"{len(pockets)} pockets of 20 or more, largest {pockets[0] if pockets else None}")
+
+    start = time.perf_counter()
+    coverage.remove(guards[:1])
+    coverage.add(guards[:1])
+    print(f"one guard moved out and back in {time.perf_counter() - start:.4f}s", coverage.stats()["covered_area"])
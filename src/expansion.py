@@ -0,0 +1,381 @@
+"""
+Visibility polygons by triangular expansion: the scene is triangulated
+once, with every obstacle and bounds edge an edge of the triangulation,
+and a query walks the triangles outwards from the one holding the
+viewpoint. Each step looks through an edge of a triangle within a cone of
+view narrowed by the vertices passed so far, so a query touches only the
+triangles it can see into instead of sorting every vertex of the scene.
+Meant for many queries on one static scene.
+
+    triangulation = triangulate(scene)
+    edges = list(expand(point, triangulation))
+"""
+from threading import Lock
+from weakref import WeakKeyDictionary
+
+from visual_objects import Point, Edge, Polygon
+from scene import Scene
+from output import Output
+from predicates import orientation, incircle
+from visibility import get_scene
+
+# scene -> its triangulation, remade when the scene's version changes
+triangulations = WeakKeyDictionary()
+lock = Lock()
+
+
+class Triangulation:
+    """
+    Constrained triangulation of the scene's bounds rectangle with the
+    scene's vertices and edges. The triangles are kept as the apex of every
+    directed edge: (a, b, apex[a, b]) is a triangle counterclockwise, and
+    apex[b, a] is the third vertex of the one across the edge. Vertices are
+    numbered as in scene.vertices. `constraints` maps the scene edges, as
+    ordered (low, high) vertex pairs, to their index in scene.edges; an
+    edge with a vertex lying on it is split into constraints between them.
+
+    Built as a Delaunay triangulation of the vertices (insertion with edge
+    flips) into which the edges are forced by flipping the edges they cross.
+    """
+
+    def __init__(self, scene: Scene):
+        self.scene = scene
+        self.version = scene.version
+        self.x, self.y = (row.tolist() for row in scene.coordinates)
+        self.points = scene.vertices
+        self.apex = {}
+        # a vertex every vertex has an edge to, kept up to date by add
+        self.out = {}
+        self.constraints = {}
+        self.last = None
+
+        # the bounds are a rectangle, maybe with more vertices on its sides
+        # (a scene clipped by Scene.around), inserted like the others
+        ids = {xy: i for i, xy in enumerate(zip(self.x, self.y))}
+        min_x, min_y, max_x, max_y = scene.bounds_box
+        corners = [ids.get(xy) for xy in ((min_x, min_y), (max_x, min_y), (max_x, max_y), (min_x, max_y))]
+        if None in corners:
+            raise ValueError("Expected a rectangle as the scene bounds")
+        a, b, c, d = corners
+        self.add(a, b, c)
+        self.add(a, c, d)
+
+        for i in self.insertion_order(set(corners)):
+            self.insert(i)
+        for index, edge in enumerate(scene.edges):
+            self.constrain(ids[edge.a.coordinates], ids[edge.b.coordinates], index)
+
+    def insertion_order(self, skip: set) -> [int]:
+        # rows of the box, alternately left to right and back: consecutive
+        # vertices lie close together, so locating each is a short walk
+        rest = [i for i in range(len(self.x)) if i not in skip]
+        if not rest:
+            return rest
+        min_y, max_y = min(self.y[i] for i in rest), max(self.y[i] for i in rest)
+        rows = max(1, int(len(rest) ** 0.5))
+        height = (max_y - min_y) / rows or 1.0
+        row = {i: min(rows - 1, int((self.y[i] - min_y) / height)) for i in rest}
+        return sorted(rest, key=lambda i: (row[i], self.x[i] if row[i] % 2 == 0 else -self.x[i]))
+
+    def orient(self, a: int, b: int, c: int) -> int:
+        return orientation(self.x[a], self.y[a], self.x[b], self.y[b], self.x[c], self.y[c])
+
+    def add(self, a: int, b: int, c: int):
+        self.apex[a, b] = c
+        self.apex[b, c] = a
+        self.apex[c, a] = b
+        self.out[a], self.out[b], self.out[c] = b, c, a
+        self.last = a, b
+
+    def delete(self, a: int, b: int, c: int):
+        del self.apex[a, b], self.apex[b, c], self.apex[c, a]
+
+    def locate(self, x: float, y: float):
+        """
+        A counterclockwise triangle (a, b, c) holding the point, by walking
+        from the last triangle made towards it, and the orientation of the
+        point to each of its edges (a, b), (b, c), (c, a): all 1 inside, one
+        0 on an edge, two 0 at a vertex.
+        """
+        a, b = self.last
+        c = self.apex[a, b]
+        while True:
+            sides = []
+            for u, v in ((a, b), (b, c), (c, a)):
+                side = orientation(self.x[u], self.y[u], self.x[v], self.y[v], x, y)
+                if side < 0:
+                    break
+                sides.append(side)
+            else:
+                return (a, b, c), sides
+            # the point lies beyond edge (u, v): step into the triangle there
+            if (v, u) not in self.apex:
+                raise ValueError(f"Point ({x}, {y}) is outside of the scene bounds")
+            a, b, c = v, u, self.apex[v, u]
+
+    def insert(self, p: int):
+        (a, b, c), sides = self.locate(self.x[p], self.y[p])
+        if sides.count(0) > 1:
+            return
+        if 0 not in sides:
+            self.delete(a, b, c)
+            self.add(a, b, p)
+            self.add(b, c, p)
+            self.add(c, a, p)
+            self.legalize(p, [(a, b), (b, c), (c, a)])
+            return
+
+        # on an edge: split the triangles on both sides of it
+        k = sides.index(0)
+        a, b, c = (a, b, c)[k:] + (a, b, c)[:k]
+        self.delete(a, b, c)
+        self.add(p, c, a)
+        self.add(p, b, c)
+        edges = [(c, a), (b, c)]
+        d = self.apex.get((b, a))
+        if d is not None:
+            self.delete(b, a, d)
+            self.add(p, a, d)
+            self.add(p, d, b)
+            edges += [(a, d), (d, b)]
+        self.legalize(p, edges)
+
+    def legalize(self, p: int, edges: [tuple]):
+        # flip edges (a, b) of new triangles (p, a, b) whose neighbour's apex
+        # lies inside their circumcircle
+        x, y = self.x, self.y
+        while edges:
+            a, b = edges.pop()
+            d = self.apex.get((b, a))
+            if d is None or incircle(x[p], y[p], x[a], y[a], x[b], y[b], x[d], y[d]) <= 0:
+                continue
+            if self.orient(p, d, a) * self.orient(p, d, b) >= 0:
+                continue
+            self.flip(a, b)
+            edges += [(a, d), (d, b)]
+
+    def flip(self, a: int, b: int):
+        # triangles (a, b, c) and (b, a, d) become (a, d, c) and (d, b, c)
+        c, d = self.apex[a, b], self.apex[b, a]
+        self.delete(a, b, c)
+        self.delete(b, a, d)
+        self.add(a, d, c)
+        self.add(d, b, c)
+
+    def constrain(self, u: int, v: int, index: int):
+        while u != v:
+            u = self.force(u, v, index)
+
+    def force(self, u: int, v: int, index: int) -> int:
+        """
+        Makes (u, v) an edge, or its part up to the first vertex lying on it,
+        and returns where the constraint ends.
+        """
+        if (u, v) in self.apex or (v, u) in self.apex:
+            self.constraints[min(u, v), max(u, v)] = index
+            return v
+
+        # the triangle around u the segment leaves it through, turning
+        # counterclockwise from the first one: around a vertex on the hull
+        # the triangles don't close the circle
+        w = first = self.out[u]
+        while (w, u) in self.apex and self.apex[w, u] != first:
+            w = self.apex[w, u]
+        for _ in range(len(self.x)):
+            left = self.apex.get((u, w))
+            if left is None:
+                raise ValueError(f"Can't find edge {u}-{v} around its end")
+            if self.orient(u, w, v) == 0 and self.ahead(u, v, w):
+                # a vertex on the segment splits the constraint
+                self.constraints[min(u, w), max(u, w)] = index
+                return w
+            if self.orient(u, w, v) > 0 and self.orient(u, v, left) > 0:
+                break
+            w = left
+        else:
+            raise ValueError(f"Can't find edge {u}-{v} around its end")
+
+        # the edges crossed on the way to v, each from the right side to the left
+        crossed, right, left = [], w, self.apex[u, w]
+        while True:
+            if (min(right, left), max(right, left)) in self.constraints:
+                raise ValueError(f"Scene edges cross at {self.points[u]}-{self.points[v]}")
+            crossed.append((right, left))
+            far = self.apex[left, right]
+            if far == v:
+                break
+            side = self.orient(u, v, far)
+            if side == 0:
+                v = far
+                break
+            if side > 0:
+                left = far
+            else:
+                right = far
+
+        # flip them away; a flip that is not possible yet waits for the others
+        while crossed:
+            a, b = crossed.pop(0)
+            c, d = self.apex[a, b], self.apex[b, a]
+            if self.orient(c, d, a) * self.orient(c, d, b) >= 0:
+                crossed.append((a, b))
+                continue
+            self.flip(a, b)
+            if c not in (u, v) and d not in (u, v) and self.orient(u, v, c) * self.orient(u, v, d) < 0:
+                crossed.append((c, d) if self.orient(u, v, c) < 0 else (d, c))
+        self.constraints[min(u, v), max(u, v)] = index
+        return v
+
+    def ahead(self, u: int, v: int, w: int) -> bool:
+        # w between u and v on their line
+        ux, uy, vx, vy, wx, wy = self.x[u], self.y[u], self.x[v], self.y[v], self.x[w], self.y[w]
+        return (wx - ux) * (vx - ux) + (wy - uy) * (vy - uy) > 0 and \
+            (wx - vx) * (ux - vx) + (wy - vy) * (uy - vy) > 0
+
+    def __len__(self):
+        return len(self.apex) // 3
+
+
+def triangulate(scene: Scene) -> Triangulation:
+    # the scene's triangulation, made on first use and after every edit;
+    # queries only read it, so threads share one
+    with lock:
+        triangulation = triangulations.get(scene)
+        if triangulation is None or triangulation.version != scene.version:
+            triangulation = triangulations[scene] = Triangulation(scene)
+        return triangulation
+
+
+def cut(point: Point, through: tuple, a: tuple, b: tuple) -> Point:
+    # where the ray from the point through `through` meets the edge a-b
+    (tx, ty), (ax, ay), (bx, by) = through, a, b
+    dx, dy, ex, ey = tx - point.x, ty - point.y, bx - ax, by - ay
+    t = (dx * (ay - point.y) - dy * (ax - point.x)) / (dy * ex - dx * ey)
+    t = min(1.0, max(0.0, t))
+    return Point(ax + t * ex, ay + t * ey)
+
+
+def expand(point: Point, triangulation: Triangulation) -> Output:
+    """
+    Boundary edges of the visibility polygon of the point, counterclockwise,
+    as the sweep gives them: the visible parts of scene edges joined by
+    invisible edges along the rays where the view passes a vertex.
+    """
+    t = triangulation
+    x, y, apex = t.x, t.y, t.apex
+    px, py = point.x, point.y
+    (a, b, c), sides = t.locate(px, py)
+    if sides.count(0) > 1:
+        raise ValueError(f"Point {point} is a vertex of the scene")
+
+    def orient(u, v):
+        return orientation(px, py, x[u], y[u], x[v], y[v])
+
+    # the edges around the point, counterclockwise, each looked through as a
+    # whole: (a, b) with a right and b left of the view, and the cone (r, l)
+    if 0 not in sides:
+        views = [(a, b), (b, c), (c, a)]
+    else:
+        k = sides.index(0)
+        a, b, c = (a, b, c)[k:] + (a, b, c)[:k]
+        if (min(a, b), max(a, b)) in t.constraints:
+            raise ValueError(f"Point {point} lies on a scene edge")
+        d = apex[b, a]
+        views = [(b, c), (c, a), (a, d), (d, b)]
+    stack = [(u, v, u, v) for u, v in reversed(views)]
+
+    pieces = []
+    while stack:
+        a, b, r, l = stack.pop()
+        key = min(a, b), max(a, b)
+        index = t.constraints.get(key)
+        if index is not None:
+            pieces.append((a, b, r, l, index))
+            continue
+        # the triangle beyond (a, b) and its edges (a, c) and (c, b), each
+        # seen where c doesn't hide it from the cone
+        c = apex[b, a]
+        right, left = orient(r, c) > 0, orient(c, l) > 0
+        if left:
+            stack.append((c, b, c if right else r, l))
+        if right:
+            stack.append((a, c, r, c if left else l))
+
+    points, edges = t.points, t.scene.edges
+    output = Output()
+    parts = []
+    for a, b, r, l, index in pieces:
+        start = points[a] if r == a else cut(point, points[r].coordinates, points[a].coordinates, points[b].coordinates)
+        end = points[b] if l == b else cut(point, points[l].coordinates, points[a].coordinates, points[b].coordinates)
+        if parts and parts[-1][2] == index and parts[-1][1].coordinates == start.coordinates:
+            # the next part of the same scene edge, past a vertex behind it
+            parts[-1][1] = end
+        else:
+            parts.append([start, end, index])
+    if len(parts) > 1 and parts[0][2] == parts[-1][2] and parts[-1][1].coordinates == parts[0][0].coordinates:
+        parts[0][0] = parts.pop()[0]
+
+    for i, (start, end, index) in enumerate(parts):
+        output.append(Edge(start, end, visible=edges[index].visible))
+        following = parts[(i + 1) % len(parts)][0]
+        if following.coordinates != end.coordinates:
+            output.append(Edge(end, following, visible=False))
+    return output
+
+
+def expansion_algorithm(point: Point, polygons: [Polygon]) -> [Edge]:
+    # the same result as asano_algorithm; pass a Scene to triangulate it once
+    scene = get_scene(point, polygons)
+    return list(expand(point, triangulate(scene)))
+
+
+def expansion_polygon(point: Point, polygons: [Polygon]):
+    # ordered vertices of the visibility polygon, as visibility_polygon gives them
+    scene = get_scene(point, polygons)
+    return expand(point, triangulate(scene)).ring()
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    import numpy as np
+
+    from visibility import asano_algorithm, visibility_polygon
+
+    def area(ring):
+        x, y = ring[:, 0], ring[:, 1]
+        return 0.5 * float(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+    polygons = []
+    for i in range(20, 1000, 50):
+        for j in range(20, 1000, 50):
+            polygons.append(Polygon([
+                Point(i, j),
+                Point(i + 10, j),
+                Point(i + 10, j + 10),
+                Point(i, j + 10),
+            ]))
+    scene = Scene(polygons)
+
+    start = time.perf_counter()
+    triangulation = triangulate(scene)
+    print(f"{len(scene.vertices)} vertices, {len(triangulation)} triangles in {time.perf_counter() - start:.3f}s")
+
+    random.seed(1)
+    points = [Point(random.uniform(0, 1000), random.uniform(0, 1000)) for _ in range(300)]
+    points = [p for p in points if not any(
+        i <= p.x <= i + 10 and j <= p.y <= j + 10 for i in range(20, 1000, 50) for j in range(20, 1000, 50))]
+
+    start = time.perf_counter()
+    for point in points:
+        asano_algorithm(point, scene)
+    asano = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for point in points:
+        expansion_algorithm(point, scene)
+    expansion = time.perf_counter() - start
+
+    worst = max(abs(area(expansion_polygon(p, scene)[0]) - area(visibility_polygon(p, scene)[0])) for p in points)
+    print(f"{len(points)} queries: asano={asano:.3f}s expansion={expansion:.3f}s, largest area difference {worst:.2e}")
@@ -0,0 +1,172 @@
+"""
+Counters and timers for the sweep, installed only while a recording is on:
+
+    with metrics.recording() as record:
+        asano_algorithm(point, polygons)
+    record.as_dict()
+
+Recording wraps the counted functions and methods in place (and puts them
+back afterwards), so with it off the algorithm runs its own unwrapped code
+and pays nothing. The wrappers are process wide: queries of other threads
+in the meantime are counted too.
+"""
+import time
+from collections import Counter, defaultdict
+from functools import wraps
+
+import visual_objects
+import tree
+import tree_
+import vectorized
+import visibility
+
+# the global flag: True while a recording is on
+enabled = False
+active = None
+
+# (owner, attribute, name): calls are counted; "closer" counts every edge
+# comparison of the sweep, is_closer only hands its own on to it
+COUNTED = [
+    (visual_objects.Ray, "intersect", "intersect"),
+    (visual_objects.RayOrder, "closer", "closer"),
+    (vectorized, "exact_angle", "exact_angle"),
+    (visual_objects, "get_pseudo_angle", "get_pseudo_angle"),
+    (visibility, "get_pseudo_angle", "get_pseudo_angle"),
+]
+
+# (owner, attribute, name): calls are counted and timed, nested calls included;
+# only calls looking the function up on its owner at call time are seen,
+# so callers use visibility.sweep_scene, not a name imported from it
+TIMED = [
+    (tree.Tree, "insert", "tree.insert"),
+    (tree.Tree, "delete", "tree.delete"),
+    (tree.Tree, "update", "tree.update"),
+    (tree_.Tree, "insert", "tree.insert"),
+    (tree_.Tree, "delete", "tree.delete"),
+    (tree_.Tree, "update", "tree.update"),
+    (visibility, "construct_begin_edge", "output"),
+    (visibility, "construct_end_edge", "output"),
+    (visibility, "construct_sector_end", "output"),
+    (visibility, "update_output", "output"),
+    # the phases of a query
+    (visibility, "get_scene", "scene"),
+    (visibility, "initial_status", "status"),
+    (vectorized, "sort_edges", "sort_edges"),
+    (visibility, "sort_events", "events"),
+    (visibility, "sweep_scene", "sweep"),
+    (visibility, "sweep", "query"),
+]
+
+
+class Recording:
+    """
+    Counters and wall-clock seconds gathered while it is on. `callback`,
+    if given, gets the dict of every single query right after it ends.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.counters = Counter()
+        self.timers = defaultdict(float)
+
+    def counted(self, function, name):
+        counters = self.counters
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            counters[name] += 1
+            return function(*args, **kwargs)
+        return wrapper
+
+    def timed(self, function, name):
+        counters, timers = self.counters, self.timers
+        query = name == "query"
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            before = self.as_dict() if query and self.callback else None
+            counters[name] += 1
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timers[name] += time.perf_counter() - start
+                if before is not None:
+                    self.callback(difference(self.as_dict(), before))
+        return wrapper
+
+    def as_dict(self) -> dict:
+        # the sweep loop is the sweep without its status and events phases
+        timers = dict(self.timers)
+        if "sweep" in timers:
+            timers["loop"] = max(timers["sweep"] - timers.get("status", 0.0) - timers.get("events", 0.0), 0.0)
+        return {"counters": dict(self.counters), "timers": timers}
+
+    def reset(self):
+        self.counters.clear()
+        self.timers.clear()
+
+    def __enter__(self):
+        global enabled, active
+        if enabled:
+            raise RuntimeError("A recording is already on")
+        self.originals = []
+        for targets, wrap in ((COUNTED, self.counted), (TIMED, self.timed)):
+            for owner, attribute, name in targets:
+                original = owner.__dict__[attribute]
+                self.originals.append((owner, attribute, original))
+                setattr(owner, attribute, wrap(original, name))
+        enabled, active = True, self
+        return self
+
+    def __exit__(self, *exc):
+        global enabled, active
+        for owner, attribute, original in reversed(self.originals):
+            setattr(owner, attribute, original)
+        enabled, active = False, None
+        return False
+
+
+def difference(after: dict, before: dict) -> dict:
+    return {
+        group: {name: value - before[group].get(name, 0) for name, value in values.items()
+                if value != before[group].get(name, 0)}
+        for group, values in after.items()
+    }
+
+
+def recording(callback=None) -> Recording:
+    return Recording(callback)
+
+
+if __name__ == "__main__":
+    from visual_objects import Point, Polygon
+    from scene import Scene
+
+    polygons = []
+    for i in range(20, 1000, 50):
+        for j in range(20, 1000, 50):
+            polygons.append(Polygon([
+                Point(i, j),
+                Point(i + 10, j),
+                Point(i + 10, j + 10),
+                Point(i, j + 10),
+            ]))
+    scene = Scene(polygons)
+    point = Point(455.5, 455.3)
+
+    start = time.perf_counter()
+    for _ in range(10):
+        visibility.asano_algorithm(point, scene)
+    plain = time.perf_counter() - start
+
+    with recording(callback=lambda query: None) as record:
+        start = time.perf_counter()
+        for _ in range(10):
+            visibility.asano_algorithm(point, scene)
+        recorded = time.perf_counter() - start
+
+    print(f"plain={plain:.3f}s recorded={recorded:.3f}s")
+    for group, values in record.as_dict().items():
+        for name, value in sorted(values.items()):
+            print(f"{group:8s} {name:18s} {value:.4f}" if group == "timers" else f"{group:8s} {name:18s} {value}")
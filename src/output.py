@@ -0,0 +1,85 @@
+import numpy as np
+
+from visual_objects import Edge
+
+
+class Output:
+    """
+    Boundary edges of a visibility polygon in the order the sweep finds
+    them. Edges are indexed by identity, so membership tests and replacing
+    an edge by its visible part are O(1).
+    """
+
+    def __init__(self, trace=False):
+        self.edges = []
+        self.index = {}
+        # id(point) -> (point, scene edge, ray end) for every point the sweep
+        # cut from a scene edge with a ray and id(part) -> (part, scene edge)
+        # for the parts of edges in the status, kept only when tracing
+        self.sources = {} if trace else None
+        self.origins = {}
+
+    def __contains__(self, edge: Edge):
+        return id(edge) in self.index
+
+    def __iter__(self):
+        return (edge for edge in self.edges if edge is not None)
+
+    def __len__(self):
+        return len(self.index)
+
+    def append(self, edge: Edge):
+        self.index[id(edge)] = len(self.edges)
+        self.edges.append(edge)
+
+    def origin(self, edge: Edge) -> Edge:
+        return self.origins.get(id(edge), (edge, edge))[1]
+
+    def part(self, part: Edge, edge: Edge):
+        if self.sources is not None:
+            self.origins[id(part)] = part, self.origin(edge)
+
+    def trace(self, point, edge: Edge, ray):
+        if self.sources is not None:
+            self.sources[id(point)] = point, self.origin(edge), ray.end
+
+    def cut(self, ray, edge: Edge):
+        # ray.intersect(edge), traced
+        point = ray.intersect(edge)
+        if point is not None:
+            self.trace(point, edge, ray)
+        return point
+
+    def replace(self, old: Edge, new: Edge):
+        position = self.index.pop(id(old))
+        self.index[id(new)] = position
+        self.edges[position] = new
+
+    def remove(self, edge: Edge):
+        self.edges[self.index.pop(id(edge))] = None
+
+    def ring(self):
+        """
+        The polygon as an (n, 2) array of vertices in sweep order and an
+        array of n flags, flag i being Edge.visible of the segment from
+        vertex i to vertex i + 1 (the last one closes the ring).
+        """
+        edges = list(self)
+        if not edges:
+            return np.empty((0, 2)), np.empty(0, dtype=bool)
+
+        # every edge starts where the previous one ends: orient them so
+        start, end = edges[0].a, edges[0].b
+        if len(edges) > 1:
+            following = edges[1]
+            near = lambda p: min(p.dist(following.a), p.dist(following.b))
+            if near(start) < near(end):
+                start, end = end, start
+
+        vertices = [start.coordinates]
+        for edge in edges[1:]:
+            start, end = (edge.a, edge.b) if end.dist(edge.a) <= end.dist(edge.b) else (edge.b, edge.a)
+            vertices.append(start.coordinates)
+
+        visible = [edge.visible for edge in edges]
+        return np.array(vertices, dtype=np.float64), np.array(visible, dtype=bool)
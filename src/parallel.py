@@ -0,0 +1,181 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from visual_objects import Point, Edge, Polygon
+from visibility import asano_algorithm
+from scene import Scene
+
+# scene of the current worker process, set once by init_worker
+scene = None
+
+
+def init_worker(shared: Scene):
+    # with the fork start method the pool hands the scene over by memory
+    # inheritance, other start methods pickle it once per worker
+    global scene
+    scene = shared
+
+
+def query_points(shared: Scene, points: [tuple]) -> [[Edge]]:
+    # a query only reads the scene, so threads may run this on one scene at once
+    return [asano_algorithm(Point(x, y), shared) for x, y in points]
+
+
+def query_chunk(points: [tuple]):
+    return [
+        [(e.a.x, e.a.y, e.b.x, e.b.y, e.visible) for e in edges]
+        for edges in query_points(scene, points)
+    ]
+
+
+def to_edges(result: [tuple]) -> [Edge]:
+    return [Edge(Point(ax, ay), Point(bx, by), visible=visible)
+            for ax, ay, bx, by, visible in result]
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def get_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("fork" if "fork" in methods else None)
+
+
+def visibility_many(points: [Point], polygons: [Polygon], workers=None, chunk_size=64, prefetch=2, threads=False):
+    """
+    Yields asano_algorithm(point, scene) for every point, in input order.
+    The scene is `polygons` when it is a Scene; a list of polygons is made
+    one with the bounds of the viewpoints too when `points` is a list or a
+    tuple, and with the polygons' bounds alone for a lazy stream, whose
+    viewpoints outside them raise ValueError.
+
+    Viewpoints are sent to the workers in chunks of (x, y) tuples, at most
+    `prefetch` chunks per worker are in flight, so `points` may be a lazy
+    stream of any length.
+
+    With `threads` the workers are threads of this process sharing the one
+    scene, with no copies and no pickling of results; they run in parallel
+    on free-threaded builds and while NumPy kernels release the GIL.
+    """
+    if isinstance(polygons, Scene):
+        shared = polygons
+    else:
+        shared = Scene(polygons, points if isinstance(points, (list, tuple)) else ())
+    workers = workers or multiprocessing.cpu_count()
+    coordinates = ((p.x, p.y) for p in points)
+
+    if threads:
+        yield from threaded_many(shared, coordinates, workers, chunk_size, prefetch)
+        return
+
+    if workers == 1:
+        for chunk in chunks(coordinates, chunk_size):
+            yield from query_points(shared, chunk)
+        return
+
+    with get_context().Pool(workers, initializer=init_worker, initargs=(shared,)) as pool:
+        pending = deque()
+        for chunk in chunks(coordinates, chunk_size):
+            pending.append(pool.apply_async(query_chunk, (chunk,)))
+            if len(pending) >= workers * prefetch:
+                for result in pending.popleft().get():
+                    yield to_edges(result)
+        while pending:
+            for result in pending.popleft().get():
+                yield to_edges(result)
+
+
+def threaded_many(shared: Scene, coordinates, workers: int, chunk_size: int, prefetch: int):
+    with ThreadPoolExecutor(workers) as executor:
+        pending = deque()
+        for chunk in chunks(coordinates, chunk_size):
+            pending.append(executor.submit(query_points, shared, chunk))
+            if len(pending) >= workers * prefetch:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+if __name__ == "__main__":
+    # scaling benchmark: one map, the same viewpoints, 1..cpu_count workers
+    import random
+    import time
+
+    polygons = []
+    for i in range(20, 1000, 50):
+        for j in range(20, 1000, 50):
+            polygons.append(Polygon([
+                Point(i, j),
+                Point(i + 10, j),
+                Point(i + 10, j + 10),
+                Point(i, j + 10),
+            ]))
+
+    random.seed(1)
+    points = [Point(random.uniform(0, 1000), random.uniform(0, 1000)) for _ in range(100)]
+
+    shared = Scene(polygons)
+    base = None
+    for workers in range(1, multiprocessing.cpu_count() + 1):
+        start = time.perf_counter()
+        count = sum(1 for _ in visibility_many(points, shared, workers=workers, chunk_size=16))
+        elapsed = time.perf_counter() - start
+        base = base or elapsed
+        print(f"workers={workers:2d} queries={count} time={elapsed:.2f}s "
+              f"rate={count / elapsed:.0f}/s speedup={base / elapsed:.2f}x")
+
+    for workers in (1, 4):
+        start = time.perf_counter()
+        count = sum(1 for _ in visibility_many(points, shared, workers=workers, chunk_size=16, threads=True))
+        print(f"threads={workers} queries={count} time={time.perf_counter() - start:.2f}s")
+
+    # stress: many threads querying one scene at once, switching as often as
+    # possible, against the same queries run one by one
+    import sys
+
+    import numpy as np
+
+    from visibility import visibility_polygon
+
+    # four triangles meeting at one shared vertex object, and the query
+    # types a game mixes: full, bounded by distance, cone of vision
+    corner = Point(500, 500)
+    stressed = Scene(polygons + [
+        Polygon([corner, Point(500 + 10 * dx - 3 * dy, 500 + 10 * dy + 3 * dx),
+                 Point(500 + 10 * dx + 3 * dy, 500 + 10 * dy - 3 * dx)])
+        for dx, dy in ((1, 0), (0, 1), (-1, 0), (0, -1))
+    ])
+    tasks = [(p, options) for p in points[:40] + [Point(505, 480), Point(480, 505)]
+             for options in ({}, {"max_distance": 150}, {"fov": (1.0, 2.0)})]
+    segments, vertices = stressed.segments.copy(), [(v, v.x, v.y) for v in stressed.vertices]
+
+    def run(task):
+        point, options = task
+        return visibility_polygon(point, stressed, **options)
+
+    expected = [run(task) for task in tasks]
+    sys.setswitchinterval(1e-6)
+    random.seed(2)
+    order = [i for i in range(len(tasks)) for _ in range(5)]
+    random.shuffle(order)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(16) as executor:
+        results = list(executor.map(lambda i: run(tasks[i]), order))
+    elapsed = time.perf_counter() - start
+    sys.setswitchinterval(0.005)
+
+    mismatches = sum(
+        not (np.array_equal(ring, expected[i][0]) and np.array_equal(visible, expected[i][1]))
+        for i, (ring, visible) in zip(order, results)
+    )
+    untouched = np.array_equal(segments, stressed.segments) and \
+        all(v is w and v.x == x and v.y == y for w, (v, x, y) in zip(stressed.vertices, vertices))
+    print(f"stress: {len(order)} concurrent queries on 16 threads in {elapsed:.2f}s, "
+          f"mismatches {mismatches}, scene untouched {untouched}")
@@ -0,0 +1,123 @@
+"""
+Exact geometric predicates on float coordinates. Each test is computed in
+floats first and trusted when the result is farther from zero than its
+worst rounding error (Shewchuk's error bound for 2x2 determinants); only
+the few cases within that bound, collinear points above all, are redone
+with Fractions, which represent every float exactly.
+"""
+from fractions import Fraction
+
+import numpy as np
+
+# relative error bound of a float sum or difference of two float products
+# of float differences (Shewchuk's ccwerrboundA)
+ERROR = (3 + 16 * 2 ** -53) * 2 ** -53
+# the same for the 3x3 incircle determinant (iccerrboundA)
+INCIRCLE_ERROR = (10 + 96 * 2 ** -53) * 2 ** -53
+
+
+def exact_orientation(ax, ay, bx, by, cx, cy) -> int:
+    ax, ay, bx, by, cx, cy = map(Fraction, (ax, ay, bx, by, cx, cy))
+    det = (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+    return (det > 0) - (det < 0)
+
+
+def exact_direction(ax, ay, bx, by, cx, cy) -> int:
+    ax, ay, bx, by, cx, cy = map(Fraction, (ax, ay, bx, by, cx, cy))
+    dot = (bx - ax) * (cx - ax) + (by - ay) * (cy - ay)
+    return (dot > 0) - (dot < 0)
+
+
+def exact_incircle(ax, ay, bx, by, cx, cy, dx, dy) -> int:
+    ax, ay, bx, by, cx, cy, dx, dy = map(Fraction, (ax, ay, bx, by, cx, cy, dx, dy))
+    adx, ady, bdx, bdy, cdx, cdy = ax - dx, ay - dy, bx - dx, by - dy, cx - dx, cy - dy
+    det = ((adx * adx + ady * ady) * (bdx * cdy - cdx * bdy)
+           + (bdx * bdx + bdy * bdy) * (cdx * ady - adx * cdy)
+           + (cdx * cdx + cdy * cdy) * (adx * bdy - bdx * ady))
+    return (det > 0) - (det < 0)
+
+
+def orientation(ax, ay, bx, by, cx, cy) -> int:
+    # 1 if c lies left of the line a -> b (counterclockwise), -1 right of it, 0 on it
+    left = (bx - ax) * (cy - ay)
+    right = (by - ay) * (cx - ax)
+    det = left - right
+    bound = ERROR * (abs(left) + abs(right))
+    if det > bound:
+        return 1
+    if det < -bound:
+        return -1
+    return exact_orientation(ax, ay, bx, by, cx, cy)
+
+
+def direction(ax, ay, bx, by, cx, cy) -> int:
+    # sign of the dot product of b - a and c - a: 1 if c lies ahead of a towards b
+    first = (bx - ax) * (cx - ax)
+    second = (by - ay) * (cy - ay)
+    dot = first + second
+    bound = ERROR * (abs(first) + abs(second))
+    if dot > bound:
+        return 1
+    if dot < -bound:
+        return -1
+    return exact_direction(ax, ay, bx, by, cx, cy)
+
+
+def incircle(ax, ay, bx, by, cx, cy, dx, dy) -> int:
+    # 1 if d lies inside the circle through counterclockwise a, b, c, -1 outside it, 0 on it
+    adx, ady, bdx, bdy, cdx, cdy = ax - dx, ay - dy, bx - dx, by - dy, cx - dx, cy - dy
+    alift, blift, clift = adx * adx + ady * ady, bdx * bdx + bdy * bdy, cdx * cdx + cdy * cdy
+    det = alift * (bdx * cdy - cdx * bdy) + blift * (cdx * ady - adx * cdy) + clift * (adx * bdy - bdx * ady)
+    permanent = (alift * (abs(bdx * cdy) + abs(cdx * bdy)) + blift * (abs(cdx * ady) + abs(adx * cdy))
+                 + clift * (abs(adx * bdy) + abs(bdx * ady)))
+    bound = INCIRCLE_ERROR * permanent
+    if det > bound:
+        return 1
+    if det < -bound:
+        return -1
+    return exact_incircle(ax, ay, bx, by, cx, cy, dx, dy)
+
+
+def side(ray, point) -> int:
+    # orientation of a point to a ray: 1 counterclockwise, i.e. ahead in the sweep
+    return orientation(ray.start.x, ray.start.y, ray.end.x, ray.end.y, point.x, point.y)
+
+
+def on_ray(ray, point) -> bool:
+    start, end = ray.start, ray.end
+    return side(ray, point) == 0 and direction(start.x, start.y, end.x, end.y, point.x, point.y) > 0
+
+
+def orientations(ax, ay, bx, by, cx, cy) -> np.ndarray:
+    # vectorized orientation over broadcast arrays, as int8
+    with np.errstate(invalid="ignore", over="ignore"):
+        left = (bx - ax) * (cy - ay)
+        right = (by - ay) * (cx - ax)
+        det = left - right
+        bound = ERROR * (np.abs(left) + np.abs(right))
+    signs = np.where(det > bound, 1, np.where(det < -bound, -1, 0)).astype(np.int8)
+
+    uncertain = np.flatnonzero(np.abs(det) <= bound)
+    if len(uncertain):
+        shape = signs.shape
+        arrays = [np.broadcast_to(array, shape).ravel()[uncertain].tolist()
+                  for array in (ax, ay, bx, by, cx, cy)]
+        signs.ravel()[uncertain] = [exact_orientation(*args) for args in zip(*arrays)]
+    return signs
+
+
+def exact_angle(px, py, rx, ry, vx, vy) -> Fraction:
+    # visual_objects.pseudo_angle of v around p from the direction to r, exactly
+    px, py, rx, ry, vx, vy = map(Fraction, (px, py, rx, ry, vx, vy))
+    rx, ry, vx, vy = rx - px, ry - py, vx - px, vy - py
+    x, y = rx * vx + ry * vy, rx * vy - ry * vx
+    total = abs(x) + abs(y)
+    if total == 0:
+        return Fraction(0)
+    return 3 + x / total if y < 0 else 1 - x / total
+
+
+def exact_distance(px, py, vx, vy) -> Fraction:
+    # squared, which orders like the distance
+    dx, dy = Fraction(vx) - Fraction(px), Fraction(vy) - Fraction(py)
+    return dx * dx + dy * dy
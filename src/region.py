@@ -0,0 +1,170 @@
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+from visual_objects import Point, pseudo_angle
+from predicates import orientation, orientations
+from vectorized import TIE, pseudo_angles
+
+
+class VisibilityRegion:
+    """
+    Visibility polygon indexed by the pseudo-angle of its vertices around
+    the viewpoint. The polygon is star-shaped from there, so its vertices
+    come sorted by angle: `contains` finds the side facing a point with one
+    binary search and tells on which side of it the point lies with one
+    orientation test. Points on the boundary are inside.
+
+    `vertices` and `visible` are the ring of Output.ring (as returned by
+    visibility_polygon); with a cone of vision the ring runs through the
+    viewpoint and everything outside the cone is outside.
+    """
+
+    def __init__(self, point: Point, vertices, visible=None):
+        vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 2)
+        self.point = point
+        self.vertices = vertices
+        self.visible = visible
+
+        at_point = (vertices[:, 0] == point.x) & (vertices[:, 1] == point.y)
+        self.sector = bool(at_point.any())
+        if self.sector:
+            # start right after the viewpoint, on the first ray of the cone
+            first = int(np.flatnonzero(at_point)[0])
+            ring = np.roll(vertices, -first - 1, axis=0)[:-1]
+        else:
+            ring = vertices
+        self.empty = len(ring) < 2
+        if self.empty:
+            return
+
+        self.ray_x, self.ray_y = ring[0, 0] - point.x, ring[0, 1] - point.y
+        keys = self.angles(ring[:, 0], ring[:, 1])
+        if not self.sector:
+            # a full ring closes back on its first vertex at angle 4
+            ring = np.vstack((ring, ring[:1]))
+            keys = np.append(keys, 4.0)
+
+        # vertices next to the first ray may come out just below 4 (or the
+        # last ones just above 0)
+        near = (keys <= TIE) | (keys >= 4 - TIE)
+        leading = np.cumprod(near).astype(bool)
+        keys[leading & (keys >= 4 - TIE)] = 0.0
+        if not self.sector:
+            trailing = np.cumprod(near[::-1])[::-1].astype(bool) & ~leading
+            keys[trailing & (keys <= TIE)] = 4.0
+        # vertices on one ray from the viewpoint (a cut point is only close
+        # to it) share the key of the first of them, so the binary search
+        # never lands on a side along a ray
+        for i in np.flatnonzero(np.abs(np.diff(keys)) <= TIE).tolist():
+            keys[i + 1] = keys[i]
+        self.keys = np.maximum.accumulate(keys)
+        self.key_list = self.keys.tolist()
+        self.x, self.y = ring[:, 0].copy(), ring[:, 1].copy()
+        self.xy = ring.tolist()
+
+    def angles(self, x, y):
+        vx, vy = x - self.point.x, y - self.point.y
+        return pseudo_angles(vx * self.ray_x + vy * self.ray_y, self.ray_x * vy - self.ray_y * vx)
+
+    def facing(self, i: int, x: float, y: float) -> bool:
+        # whether the point lies on the viewpoint's side of side i (or on it)
+        if not 0 <= i < len(self.xy) - 1:
+            return False
+        (ax, ay), (bx, by) = self.xy[i], self.xy[i + 1]
+        return orientation(ax, ay, bx, by, x, y) >= 0
+
+    def contains(self, point: Point) -> bool:
+        x, y = point.x, point.y
+        if self.empty:
+            return False
+        if x == self.point.x and y == self.point.y:
+            return True
+        vx, vy = x - self.point.x, y - self.point.y
+        key = pseudo_angle(vx * self.ray_x + vy * self.ray_y, self.ray_x * vy - self.ray_y * vx)
+
+        i = bisect_right(self.key_list, key) - 1
+        if self.facing(i, x, y):
+            return True
+        # on the ray through a vertex, the side ending there may reach farther
+        if self.key_list[i] == key:
+            return self.facing(bisect_left(self.key_list, key, 0, i + 1) - 1, x, y)
+        return False
+
+    def __contains__(self, point: Point) -> bool:
+        return self.contains(point)
+
+    def contains_many(self, points) -> np.ndarray:
+        """
+        Vectorized contains for an (n, 2) array of query points, as an
+        array of n flags.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        x, y = points[:, 0], points[:, 1]
+        if self.empty:
+            return np.zeros(len(points), dtype=bool)
+
+        keys = self.angles(x, y)
+        right = np.searchsorted(self.keys, keys, side="right") - 1
+        inside = self.facing_many(right, x, y)
+        ties = np.flatnonzero(~inside & (self.keys[right] == keys))
+        if len(ties):
+            left = np.searchsorted(self.keys, keys[ties], side="left") - 1
+            inside[ties] = self.facing_many(left, x[ties], y[ties])
+        inside |= (x == self.point.x) & (y == self.point.y)
+        return inside
+
+    def facing_many(self, sides: np.ndarray, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        valid = (sides >= 0) & (sides < len(self.x) - 1)
+        i = np.where(valid, sides, 0)
+        signs = orientations(self.x[i], self.y[i], self.x[i + 1], self.y[i + 1], x, y)
+        return valid & (signs >= 0)
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    from visual_objects import Polygon
+    from scene import Scene
+    from visibility import visibility_region
+
+    polygons = []
+    for i in range(20, 1000, 50):
+        for j in range(20, 1000, 50):
+            polygons.append(Polygon([
+                Point(i, j),
+                Point(i + 10, j),
+                Point(i + 10, j + 10),
+                Point(i, j + 10),
+            ]))
+    scene = Scene(polygons)
+    point = Point(455.5, 455.3)
+    region = visibility_region(point, scene)
+
+    def crossing(vertices, x, y):
+        # the per-point test over the boundary this replaces
+        inside = False
+        for (ax, ay), (bx, by) in zip(vertices, np.roll(vertices, -1, axis=0)):
+            if (ay > y) != (by > y) and x < ax + (y - ay) * (bx - ax) / (by - ay):
+                inside = not inside
+        return inside
+
+    random.seed(1)
+    queries = np.array([(random.uniform(0, 1000), random.uniform(0, 1000)) for _ in range(2000)])
+
+    start = time.perf_counter()
+    expected = [crossing(region.vertices, x, y) for x, y in queries]
+    brute = time.perf_counter() - start
+
+    start = time.perf_counter()
+    single = [region.contains(Point(x, y)) for x, y in queries]
+    scalar = time.perf_counter() - start
+
+    start = time.perf_counter()
+    many = region.contains_many(queries)
+    vectorized = time.perf_counter() - start
+
+    print(f"{len(region.vertices)} vertices, {len(queries)} queries: crossing={brute:.3f}s "
+          f"contains={scalar:.3f}s contains_many={vectorized:.4f}s")
+    print("mismatches", sum(a != b for a, b in zip(expected, single)), sum(a != b for a, b in zip(expected, many)))
@@ -0,0 +1,404 @@
+from itertools import compress
+
+import numpy as np
+
+from visual_objects import Point, Edge, Polygon
+from spatial import Grid, clip_segments, polygon_meets_box
+
+
+def get_bounds(box, margin=20) -> Polygon:
+    min_x, min_y, max_x, max_y = box
+    return Polygon([
+        Point(min_x - margin, min_y - margin),
+        Point(max_x + margin, min_y - margin),
+        Point(max_x + margin, max_y + margin),
+        Point(min_x - margin, max_y + margin),
+    ], visible=False)
+
+
+def far_end(edge: Edge, vertex: Point):
+    # exact comparison: Edge.get_other mistakes the ends of edges shorter than eps
+    a, b = edge.a.coordinates, edge.b.coordinates
+    return b if a == vertex.coordinates else a
+
+
+def get_box(points: [Point]):
+    xs = [p.x for p in points]
+    ys = [p.y for p in points]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def join_boxes(first, second):
+    return (min(first[0], second[0]), min(first[1], second[1]),
+            max(first[2], second[2]), max(first[3], second[3]))
+
+
+def edge_segments(edges: [Edge]) -> np.ndarray:
+    # rows ax, ay, bx, by: each row is contiguous for the vectorized kernels
+    return np.array(
+        [(e.a.x, e.a.y, e.b.x, e.b.y) for e in edges], dtype=np.float64
+    ).reshape(-1, 4).T.copy()
+
+
+class Scene:
+    """
+    Polygons preprocessed once for many visibility queries: the flat edge
+    list and the vertex -> edges adjacency (both also as coordinate arrays),
+    a grid over the obstacle edges, the bounding box and the invisible
+    bounds polygon around them. Nothing here depends on the viewpoint and a
+    query never modifies it.
+
+    add_polygon, remove_polygon and move_polygon edit the obstacles in
+    place, each bumping `version` and returning the box of the edit.
+    """
+
+    def __init__(self, polygons: [Polygon], points: [Point] = (), margin=20):
+        points = list(points)
+        for polygon in polygons:
+            points += polygon.points
+
+        # the scene's own edges of every polygon, to find them again on edits
+        self.outlines = {polygon: tuple(polygon.edges) for polygon in polygons}
+        edges = [edge for outline in self.outlines.values() for edge in outline]
+
+        self.polygons = tuple(polygons)
+        self.index(edges, get_box(points), get_bounds(get_box(points), margin))
+
+    @classmethod
+    def from_edges(cls, edges: [Edge], bounds: Polygon) -> 'Scene':
+        scene = cls.__new__(cls)
+        scene.polygons = ()
+        scene.outlines = {}
+        scene.index(edges, get_box(bounds.points), bounds)
+        return scene
+
+    @classmethod
+    def from_arrays(cls, points: np.ndarray, rings: np.ndarray, offsets: np.ndarray, visible=None,
+                    margin=20) -> 'Scene':
+        """
+        Scene of polygons given as arrays: polygon k runs through the rows
+        rings[offsets[k]:offsets[k + 1]] of the (n, 2) array `points`, and
+        every row is one Point shared by all the polygons through it, so
+        the rows must be distinct. The vertex and edge arrays are built in
+        NumPy, skipping the sorting and lookups of Scene(polygons), but the
+        scene is no lazy view of them: a Point per row, an Edge per side
+        and a Polygon per ring are still made, as the sweep works on them.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        rings, offsets = np.asarray(rings, dtype=np.intp), np.asarray(offsets, dtype=np.intp)
+        lengths = np.diff(offsets)
+        if (lengths < 2).any():
+            raise ValueError("Every polygon needs at least two vertices")
+        visible = np.ones(len(lengths), dtype=bool) if visible is None else np.asarray(visible, dtype=bool)
+
+        # only the rows some polygon runs through become vertices
+        used = np.zeros(len(points), dtype=bool)
+        used[rings] = True
+        rings = (np.cumsum(used) - 1)[rings]
+        points = points[used]
+
+        # edge i of a polygon runs from its vertex i to the next one, a
+        # polygon of two vertices has just the one edge
+        following = np.arange(1, len(rings) + 1)
+        following[offsets[1:] - 1] = offsets[:-1]
+        keep = np.ones(len(rings), dtype=bool)
+        keep[offsets[1:][lengths == 2] - 1] = False
+        owner = np.repeat(np.arange(len(lengths)), lengths)[keep]
+        a, b = rings[keep], rings[following][keep]
+
+        vertices = [Point(x, y) for x, y in points.tolist()]
+        flags = visible.tolist()
+        edges = [Edge(vertices[i], vertices[j], visible=flags[k]) for i, j, k in zip(a.tolist(), b.tolist(), owner.tolist())]
+        ring_list, bounds_list = rings.tolist(), offsets.tolist()
+        polygons = [Polygon([vertices[i] for i in ring_list[start:end]], visible=flag)
+                    for start, end, flag in zip(bounds_list, bounds_list[1:], flags)]
+        starts = np.concatenate(([0], np.cumsum(np.bincount(owner, minlength=len(lengths))))).tolist()
+
+        scene = cls.__new__(cls)
+        scene.polygons = tuple(polygons)
+        scene.outlines = {polygon: tuple(edges[start:end]) for polygon, start, end in zip(polygons, starts, starts[1:])}
+        box = (*points.min(axis=0).tolist(), *points.max(axis=0).tolist()) if len(points) else (0.0, 0.0, 0.0, 0.0)
+        scene.index_arrays(edges, vertices, points, a, b, box, get_bounds(box, margin))
+        return scene
+
+    def index_arrays(self, edges: [Edge], vertices: [Point], points: np.ndarray, a: np.ndarray, b: np.ndarray,
+                     box, bounds: Polygon):
+        # index() for edges given as rows a -> b of `points`, one row per vertex
+        self.version = 0
+        self.box = box
+        self.bounds = bounds
+        self.bounds_box = get_box(bounds.points)
+        self.polygons += (bounds,)
+        self.obstacles = len(edges)
+
+        # the corners of the bounds come last
+        count = len(vertices)
+        corners = np.arange(count, count + 4)
+        a, b = np.concatenate((a, corners)), np.concatenate((b, np.roll(corners, -1)))
+        points = np.concatenate((points, [p.coordinates for p in bounds.points]))
+        self.edges = tuple(edges + bounds.edges)
+        self.vertices = tuple(vertices + list(bounds.points))
+        self.segments = np.array((points[a, 0], points[a, 1], points[b, 0], points[b, 1]))
+        self.coordinates = points.T.copy()
+
+        # columns of both ends of every edge in edge order, as index() makes them
+        ids = np.arange(len(self.edges))
+        self.arrange(
+            np.stack((a, b), axis=1).ravel(),
+            np.repeat(ids, 2),
+            np.stack((points[b], points[a]), axis=1).reshape(-1, 2).T,
+        )
+        incident, offsets = self.incident.tolist(), self.offsets.tolist()
+        self.adjacency = {
+            vertex: tuple([self.edges[i] for i in incident[start:end]])
+            for vertex, start, end in zip(self.vertices, offsets, offsets[1:])
+        }
+        self.grid = Grid(self.segments[:, :self.obstacles], self.box)
+
+    def index(self, edges: [Edge], box, bounds: Polygon):
+        self.version = 0
+        self.box = box
+        self.bounds = bounds
+        self.bounds_box = get_box(bounds.points)
+        self.polygons += (bounds,)
+        self.obstacles = len(edges)
+
+        adjacency = {}
+        edges = edges + bounds.edges
+        for edge in edges:
+            adjacency.setdefault(edge.a, []).append(edge)
+            adjacency.setdefault(edge.b, []).append(edge)
+
+        self.edges = tuple(edges)
+        self.segments = edge_segments(self.edges)
+        self.adjacency = {vertex: tuple(edges) for vertex, edges in adjacency.items()}
+        self.vertices = tuple(self.adjacency)
+
+        # vertex coordinates and, per vertex, the far endpoints of its edges
+        # (vertex i owns columns offsets[i]:offsets[i + 1] of `adjacent`,
+        # `incident` holds the index of each column's edge)
+        self.coordinates = np.array(
+            [(v.x, v.y) for v in self.vertices], dtype=np.float64
+        ).reshape(-1, 2).T.copy()
+        self.adjacent = np.array(
+            [far_end(edge, v) for v in self.vertices for edge in self.adjacency[v]],
+            dtype=np.float64,
+        ).reshape(-1, 2).T.copy()
+        position = {id(edge): i for i, edge in enumerate(self.edges)}
+        self.incident = np.array(
+            [position[id(edge)] for v in self.vertices for edge in self.adjacency[v]], dtype=np.intp
+        )
+        degrees = [len(self.adjacency[v]) for v in self.vertices]
+        self.offsets = np.concatenate(([0], np.cumsum(degrees))).astype(np.intp)
+        self.owners = np.repeat(np.arange(len(self.vertices)), degrees)
+
+        # obstacle edges come first, the bounds polygon is left out of the grid
+        self.grid = Grid(self.segments[:, :self.obstacles], self.box)
+
+    def add_polygon(self, polygon: Polygon):
+        box = self.inside_bounds(get_box(polygon.points))
+        self.outlines[polygon] = tuple(polygon.edges)
+        self.polygons = self.polygons[:-1] + (polygon, self.bounds)
+        self.insert(self.outlines[polygon])
+        return self.commit(box)
+
+    def remove_polygon(self, polygon: Polygon):
+        self.delete(self.outlines.pop(polygon))
+        self.polygons = tuple(p for p in self.polygons if p is not polygon)
+        return self.commit(get_box(polygon.points))
+
+    def move_polygon(self, polygon: Polygon, dx: float, dy: float):
+        before = get_box(polygon.points)
+        after = self.inside_bounds((before[0] + dx, before[1] + dy, before[2] + dx, before[3] + dy))
+        # the polygon's points move in place, so its edges stay the same objects
+        self.delete(self.outlines[polygon])
+        for point in polygon.points:
+            point.x, point.y = point.x + dx, point.y + dy
+        self.insert(self.outlines[polygon])
+        self.commit(after)
+        return join_boxes(before, after)
+
+    def inside_bounds(self, box):
+        min_x, min_y, max_x, max_y = self.bounds_box
+        if not (min_x < box[0] and box[2] < max_x and min_y < box[1] and box[3] < max_y):
+            raise ValueError(f"Box {box} is outside of the scene bounds")
+        return box
+
+    def commit(self, box):
+        # the box only grows: a removed polygon leaves the grid a bit larger than needed
+        self.box = join_boxes(self.box, box)
+        self.grid = Grid(self.segments[:, :self.obstacles], self.box, self.grid.cell)
+        self.version += 1
+        return box
+
+    def insert(self, edges: [Edge]):
+        # new edges go right before the bounds, new vertices after the others
+        start, count = self.obstacles, len(edges)
+        self.edges = self.edges[:start] + edges + self.edges[start:]
+        self.segments = np.concatenate(
+            (self.segments[:, :start], edge_segments(edges), self.segments[:, start:]), axis=1
+        )
+        self.incident = np.where(self.incident >= start, self.incident + count, self.incident)
+        self.obstacles += count
+
+        fresh, known, columns = {}, {}, []
+        for i, edge in enumerate(edges, start):
+            for vertex, other in ((edge.a, edge.b), (edge.b, edge.a)):
+                if vertex in fresh:
+                    owner = fresh[vertex]
+                elif vertex in self.adjacency:
+                    if vertex not in known:
+                        x, y = self.coordinates
+                        known[vertex] = int(np.flatnonzero((x == vertex.x) & (y == vertex.y))[0])
+                    owner = known[vertex]
+                else:
+                    owner = fresh[vertex] = len(self.vertices) + len(fresh)
+                self.adjacency[vertex] = self.adjacency.get(vertex, ()) + (edge,)
+                columns.append((owner, i, other.x, other.y))
+
+        self.vertices += tuple(fresh)
+        self.coordinates = np.concatenate(
+            (self.coordinates, np.array([(v.x, v.y) for v in fresh], dtype=np.float64).reshape(-1, 2).T), axis=1
+        )
+        owners, incident, x, y = np.array(columns, dtype=np.float64).reshape(-1, 4).T
+        self.arrange(
+            np.concatenate((self.owners, owners.astype(np.intp))),
+            np.concatenate((self.incident, incident.astype(np.intp))),
+            np.concatenate((self.adjacent, np.array((x, y))), axis=1),
+        )
+
+    def delete(self, edges: [Edge]):
+        # a polygon's edges stay next to each other in self.edges
+        ax, ay, bx, by = self.segments
+        first = edges[0]
+        candidates = np.flatnonzero((ax == first.a.x) & (ay == first.a.y) & (bx == first.b.x) & (by == first.b.y))
+        start = next(i for i in candidates.tolist() if self.edges[i] is first)
+        stop = start + len(edges)
+
+        self.edges = self.edges[:start] + self.edges[stop:]
+        self.segments = np.delete(self.segments, np.s_[start:stop], axis=1)
+        self.obstacles -= len(edges)
+        for edge in edges:
+            for vertex in (edge.a, edge.b):
+                remaining = tuple(other for other in self.adjacency.get(vertex, ()) if other is not edge)
+                if remaining:
+                    self.adjacency[vertex] = remaining
+                elif vertex in self.adjacency:
+                    del self.adjacency[vertex]
+
+        keep = (self.incident < start) | (self.incident >= stop)
+        incident = self.incident[keep]
+        owners = self.owners[keep]
+        alive = np.bincount(owners, minlength=len(self.vertices)) > 0
+        vertices = list(compress(self.vertices, alive.tolist()))
+        self.coordinates = self.coordinates[:, alive]
+
+        # a shared vertex may still be a point of the removed polygon, which
+        # the caller is free to move: one of the remaining edges' ends takes over
+        removed = {id(point): point for edge in edges for point in (edge.a, edge.b)}
+        x, y = self.coordinates
+        for vertex in removed.values():
+            if vertex not in self.adjacency:
+                continue
+            i = int(np.flatnonzero((x == vertex.x) & (y == vertex.y))[0])
+            if id(vertices[i]) in removed:
+                other = self.adjacency.pop(vertex)
+                kept = next(p for p in (other[0].a, other[0].b) if p.coordinates == vertex.coordinates)
+                vertices[i], self.adjacency[kept] = kept, other
+        self.vertices = tuple(vertices)
+        self.arrange(
+            (np.cumsum(alive) - 1)[owners],
+            np.where(incident >= stop, incident - len(edges), incident),
+            self.adjacent[:, keep],
+        )
+
+    def arrange(self, owners: np.ndarray, incident: np.ndarray, adjacent: np.ndarray):
+        # columns grouped by vertex again, each vertex keeping the order of its edges
+        order = np.argsort(owners, kind="stable")
+        self.owners, self.incident = owners[order], incident[order]
+        self.adjacent = adjacent[:, order].copy()
+        degrees = np.bincount(self.owners, minlength=len(self.vertices))
+        self.offsets = np.concatenate(([0], np.cumsum(degrees))).astype(np.intp)
+
+    def contains(self, point: Point):
+        min_x, min_y, max_x, max_y = self.bounds_box
+        return min_x < point.x < max_x and min_y < point.y < max_y
+
+    def around(self, point: Point, radius: float) -> 'Scene':
+        """
+        Scene of the obstacles within the box of half-size `radius` around
+        `point`, clipped to it. Its bounds polygon is that box, running
+        through the ends of the clipped edges, so a sweep over it sees at
+        most `radius` away along each axis. An obstacle lying along a side
+        of the box is left out: the box hides it just the same.
+        """
+        box = point.x - radius, point.y - radius, point.x + radius, point.y + radius
+        ids = self.grid.query(*box)
+        starts, ends = clip_segments(self.segments[:, ids], box)
+
+        # every end on the box is a vertex of the bounds too, one Point per place
+        on_box = {corner.coordinates: corner for corner in get_bounds(box, 0).points}
+
+        def end(p: Point, t: float, clipped: bool, edge: Edge) -> Point:
+            if clipped:
+                x, y = snap_to_box(edge.a.x + t * (edge.b.x - edge.a.x), edge.a.y + t * (edge.b.y - edge.a.y), box)
+                return on_box.setdefault((x, y), Point(x, y))
+            if p.x in (box[0], box[2]) or p.y in (box[1], box[3]):
+                return on_box.setdefault(p.coordinates, p)
+            return p
+
+        edges = []
+        for i, start, stop in zip(ids.tolist(), starts.tolist(), ends.tolist()):
+            if not start < stop:
+                continue
+            edge = self.edges[i]
+            a, b = end(edge.a, start, start > 0, edge), end(edge.b, stop, stop < 1, edge)
+            if a is b or box_side(a, box) & box_side(b, box):
+                continue
+            edges.append(edge if a is edge.a and b is edge.b else Edge(a, b, visible=edge.visible))
+
+        bounds = Polygon(sorted(on_box.values(), key=lambda p: perimeter(p, box)), visible=False)
+        return Scene.from_edges(edges, bounds)
+
+
+def snap_to_box(x: float, y: float, box):
+    # a point rounded off the side of `box` it was clipped at, put back on it
+    min_x, min_y, max_x, max_y = box
+    x, y = min(max(x, min_x), max_x), min(max(y, min_y), max_y)
+    side = min((abs(x - min_x), 0), (abs(x - max_x), 1), (abs(y - min_y), 2), (abs(y - max_y), 3))[1]
+    return (min_x, max_x, x, x)[side], (y, y, min_y, max_y)[side]
+
+
+def box_side(p: Point, box) -> int:
+    # bit mask of the sides of `box` the point lies on: left, right, bottom, top
+    min_x, min_y, max_x, max_y = box
+    return (p.x == min_x) | (p.x == max_x) << 1 | (p.y == min_y) << 2 | (p.y == max_y) << 3
+
+
+def perimeter(p: Point, box):
+    # counterclockwise order of the points on the box from its lower left corner
+    min_x, min_y, max_x, max_y = box
+    if p.y == min_y and p.x < max_x:
+        return 0, p.x
+    if p.x == max_x and p.y < max_y:
+        return 1, p.y
+    if p.y == max_y and p.x > min_x:
+        return 2, -p.x
+    return 3, -p.y
+
+
+def invalidated(results: dict, box) -> list:
+    """
+    Keys of `results` (key -> visibility polygon as a list of edges) whose
+    polygon meets `box`: the results an edit of that box changes.
+    """
+    stale = []
+    for key, edges in results.items():
+        if polygon_meets_box(edge_segments(edges), box):
+            stale.append(key)
+    return stale
+
+
+def vertex_edges(scene: Scene, overrides: dict, vertex: Point):
+    # edges of a vertex, with the replacements made so far by one query
+    return overrides.get(vertex) or scene.adjacency.get(vertex, ())
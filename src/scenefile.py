@@ -0,0 +1,190 @@
+"""
+Binary scene files: the polygons as flat arrays, read through a memory map.
+
+    save_scene("map.vscene", polygons)
+    scene = load_scene("map.vscene", tolerance=1e-9)
+
+Layout, little-endian, every array 8-byte aligned:
+
+    header       magic b"VISSCENE", version u32, reserved u32,
+                 vertex count u64, polygon count u64          (32 bytes)
+    coordinates  float64 (vertices, 2), every polygon's vertices in order
+    offsets      int64 (polygons + 1), polygon k owns coordinates
+                 offsets[k]:offsets[k + 1]
+    flags        uint8 (polygons), bit 0: the polygon's edges are visible
+
+Polygons store their own copy of a shared vertex; loading welds the
+vertices back together (see `weld`) and builds the scene from the arrays
+with Scene.from_arrays. Loading is still linear in Python objects: the
+copies of a vertex share one Point, but every vertex, edge and polygon
+of the scene is made, only the indexing is done on the arrays.
+"""
+import struct
+
+import numpy as np
+
+from visual_objects import Polygon
+from scene import Scene
+
+MAGIC = b"VISSCENE"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQQ")
+VISIBLE = 1
+
+
+def layout(vertices: int, polygons: int):
+    # (offset, dtype, shape) of the coordinates, offsets and flags arrays
+    coordinates = HEADER.size
+    offsets = coordinates + vertices * 16
+    flags = offsets + (polygons + 1) * 8
+    return [
+        (coordinates, np.float64, (vertices, 2)),
+        (offsets, np.int64, (polygons + 1,)),
+        (flags, np.uint8, (polygons,)),
+    ]
+
+
+def write_arrays(path: str, coordinates, offsets, flags):
+    coordinates = np.ascontiguousarray(coordinates, dtype="<f8").reshape(-1, 2)
+    offsets = np.ascontiguousarray(offsets, dtype="<i8")
+    flags = np.ascontiguousarray(flags, dtype=np.uint8)
+    if len(offsets) != len(flags) + 1 or offsets[0] != 0 or offsets[-1] != len(coordinates):
+        raise ValueError("Offsets must run from 0 to the vertex count, one more than the flags")
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, 0, len(coordinates), len(flags)))
+        for array in (coordinates, offsets, flags):
+            file.write(array.tobytes())
+
+
+def save_scene(path: str, polygons: [Polygon]):
+    # the polygons of a list or of a Scene, without its bounds
+    if isinstance(polygons, Scene):
+        polygons = [polygon for polygon in polygons.polygons if polygon is not polygons.bounds]
+    coordinates = [p.coordinates for polygon in polygons for p in polygon.points]
+    offsets = np.concatenate(([0], np.cumsum([len(polygon.points) for polygon in polygons])))
+    flags = [VISIBLE if polygon.visible else 0 for polygon in polygons]
+    write_arrays(path, np.array(coordinates, dtype=np.float64).reshape(-1, 2), offsets, flags)
+
+
+def is_scene_file(path: str) -> bool:
+    with open(path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def read_arrays(path: str):
+    """
+    The coordinates, offsets and flags of a scene file as read-only views
+    of one memory map: nothing is read until it's used.
+    """
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    if len(data) < HEADER.size:
+        raise ValueError(f"{path} is too short for a scene file")
+    magic, version, _, vertices, polygons = HEADER.unpack(data[:HEADER.size].tobytes())
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a scene file")
+    if version != VERSION:
+        raise ValueError(f"{path} has version {version}, expected {VERSION}")
+
+    arrays = []
+    for offset, dtype, shape in layout(vertices, polygons):
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if offset + size > len(data):
+            raise ValueError(f"{path} is truncated")
+        arrays.append(data[offset:offset + size].view(np.dtype(dtype).newbyteorder("<")).reshape(shape))
+    coordinates, offsets, flags = arrays
+    if offsets[0] != 0 or offsets[-1] != vertices or np.any(np.diff(offsets) < 0):
+        raise ValueError(f"{path} has invalid polygon offsets")
+    return coordinates, offsets, flags
+
+
+def weld(coordinates: np.ndarray, offsets: np.ndarray, tolerance=0.0):
+    """
+    Merges the vertices that snap to one point of a `tolerance` grid (with
+    0, the ones equal exactly) into one, at the first one's coordinates.
+    Vertices are grouped by their grid cell with one sort of the cell
+    keys. A polygon then loses the repeats of a vertex next to itself, and
+    is dropped when it has fewer than two vertices left.
+
+    Returns the vertices as an (n, 2) array, the polygons as indices into
+    it (rings and offsets, as Scene.from_arrays takes them) and the mask
+    of the polygons kept.
+    """
+    coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    offsets = np.asarray(offsets, dtype=np.intp)
+    if tolerance < 0:
+        raise ValueError(f"Tolerance must not be negative, got {tolerance}")
+    if tolerance:
+        scaled = np.round(coordinates / tolerance)
+        if len(scaled) and np.abs(scaled).max() >= 2.0 ** 62:
+            raise ValueError(f"Tolerance {tolerance} is too small for the coordinates")
+        keys = scaled.astype(np.int64)
+    else:
+        # -0.0 and 0.0 are one point
+        keys = coordinates + 0.0
+    _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    # vertices numbered in the order they first appear
+    order = np.argsort(first, kind="stable")
+    number = np.empty(len(order), dtype=np.intp)
+    number[order] = np.arange(len(order))
+    ids = number[inverse.reshape(-1)]
+    points = coordinates[first[order]]
+
+    # keep a vertex unless the next one of its polygon (cyclically) is the same
+    lengths = np.diff(offsets)
+    following = np.arange(1, len(ids) + 1)
+    following[offsets[1:][lengths > 0] - 1] = offsets[:-1][lengths > 0]
+    keep = ids != ids[following] if len(ids) else np.zeros(0, dtype=bool)
+    polygon = np.repeat(np.arange(len(lengths)), lengths)
+    counts = np.bincount(polygon[keep], minlength=len(lengths))
+    kept = counts >= 2
+    keep &= kept[polygon]
+
+    rings = ids[keep]
+    return points, rings, np.concatenate(([0], np.cumsum(counts[kept]))).astype(np.intp), kept
+
+
+def load_scene(path: str, tolerance=0.0, margin=20) -> Scene:
+    coordinates, offsets, flags = read_arrays(path)
+    points, rings, ring_offsets, kept = weld(coordinates, offsets, tolerance)
+    return Scene.from_arrays(points, rings, ring_offsets, (flags[kept] & VISIBLE) != 0, margin)
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+    import time
+
+    from visual_objects import Point
+    from visibility import visibility_polygon
+
+    # a city of blocks on a 50 x 50 grid, each block two houses meeting at
+    # a corner, stored with a copy of the shared corner in each
+    rng = np.random.default_rng(1)
+    side = 250
+    x, y = np.meshgrid(np.arange(side) * 50.0, np.arange(side) * 50.0)
+    corners = np.array([(0, 0), (10, 0), (10, 10), (0, 10)], dtype=np.float64)
+    houses = []
+    for dx, dy in ((0, 0), (10, 10)):
+        houses.append(np.stack((x.ravel(), y.ravel()), axis=1)[:, None, :] + corners + (dx, dy))
+    rings = np.concatenate(houses).reshape(-1, 2)
+    # the copies of a corner differ by rounding noise, as in exported maps
+    rings += rng.uniform(-1e-10, 1e-10, rings.shape)
+    offsets = np.arange(0, len(rings) + 1, 4)
+
+    path = os.path.join(tempfile.mkdtemp(), "city.vscene")
+    write_arrays(path, rings, offsets, np.ones(len(offsets) - 1, dtype=np.uint8))
+    print(f"{len(offsets) - 1} polygons, {len(rings)} stored vertices, {os.path.getsize(path) / 2 ** 20:.1f} MiB")
+
+    start = time.perf_counter()
+    scene = load_scene(path, tolerance=1e-6)
+    loaded = time.perf_counter() - start
+    print(f"load_scene: {loaded:.2f}s, {len(scene.vertices)} vertices after welding, {len(scene.edges)} edges")
+
+    start = time.perf_counter()
+    polygons = [Polygon([Point(px, py) for px, py in rings[a:b].tolist()]) for a, b in zip(offsets, offsets[1:])]
+    unwelded = Scene(polygons)
+    print(f"Point by Point: {time.perf_counter() - start:.2f}s, {len(unwelded.vertices)} vertices")
+
+    point = Point(25.5, 35.3)
+    vertices, visible = visibility_polygon(point, scene, max_distance=300)
+    print(f"query from {point}: {len(vertices)} vertices")
@@ -0,0 +1,362 @@
+"""
+Visibility as a service: an asyncio server over a Unix or TCP socket that
+keeps its scenes in memory and answers visibility polygon requests.
+
+Every message either way is a 4-byte big-endian length and that many
+bytes of UTF-8 JSON. A connection may send many requests without waiting;
+each response carries the `id` of its request and may come out of order.
+
+    {"id": 1, "op": "query", "scene": "map", "point": [x, y],
+     "max_distance": null, "fov": [heading, angle]}
+    -> {"id": 1, "ok": true, "vertices": [[x, y], ...], "visible": [true, ...]}
+    {"id": 2, "op": "stats"}  -> {"id": 2, "ok": true, "stats": {...}}
+    {"id": 3, "op": "scenes"} -> {"id": 3, "ok": true, "scenes": ["map"]}
+
+A failed request gets {"id": ..., "ok": false, "error": "..."}.
+
+    server = VisibilityServer({"map": Scene(polygons)}, workers=4)
+    asyncio.run(server.serve_unix("/tmp/visibility.sock"))
+"""
+import asyncio
+import json
+import struct
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from visual_objects import Point
+from scene import Scene
+from visibility import visibility_polygon
+
+HEADER = struct.Struct(">I")
+# messages longer than this are refused, the length is probably garbage
+MAX_MESSAGE = 64 * 1024 * 1024
+
+# the scenes of a worker, set once by its initializer
+scenes = None
+
+
+def start_worker(shared: dict):
+    global scenes
+    scenes = shared
+
+
+def compute_batch(tasks: [tuple]) -> [tuple]:
+    # (scene, x, y, max_distance, fov) -> (True, vertices, visible) or (False, error)
+    results = []
+    for name, x, y, max_distance, fov in tasks:
+        try:
+            vertices, visible = visibility_polygon(Point(x, y), scenes[name], max_distance=max_distance, fov=fov)
+            results.append((True, vertices.tolist(), visible.tolist()))
+        except Exception as error:
+            results.append((False, f"{type(error).__name__}: {error}"))
+    return results
+
+
+async def read_message(reader: asyncio.StreamReader):
+    # the next message, any JSON value (null too); EOFError when the peer
+    # closed the connection
+    (length,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+    if length > MAX_MESSAGE:
+        raise ValueError(f"Message of {length} bytes is too long")
+    return json.loads(await reader.readexactly(length))
+
+
+def write_message(writer: asyncio.StreamWriter, message: dict):
+    data = json.dumps(message, separators=(",", ":")).encode()
+    writer.write(HEADER.pack(len(data)) + data)
+
+
+class VisibilityServer:
+    """
+    Requests wait in a queue; the batcher takes the first one, gathers the
+    others arriving within `window` seconds (up to `max_batch`) and hands
+    the batch to a pool of `workers` processes, or threads with `threads`,
+    each holding every scene. A request for a viewpoint already queued or
+    being computed, with the same scene and options, waits for that result
+    instead of queueing again.
+
+    `stats()` reports the queue depth, the requests and batches in flight
+    and the latency percentiles of the last `history` requests.
+    """
+
+    def __init__(self, scenes: dict, workers=4, window=0.002, max_batch=256, threads=False, history=10000):
+        self.scenes = {name: s if isinstance(s, Scene) else Scene(s) for name, s in scenes.items()}
+        self.workers = workers
+        self.window = window
+        self.max_batch = max_batch
+        self.threads = threads
+
+        self.executor = None
+        self.queue = None
+        self.batcher = None
+        self.inflight = {}
+        self.batches = set()
+        self.connections = set()
+        self.latencies = deque(maxlen=history)
+        self.requests = self.computed = self.coalesced = self.errors = self.batch_count = 0
+
+    def start(self):
+        # the pool and the batcher, on the running loop
+        if self.executor is not None:
+            return
+        pool = ThreadPoolExecutor if self.threads else ProcessPoolExecutor
+        self.executor = pool(self.workers, initializer=start_worker, initargs=(self.scenes,))
+        self.queue = asyncio.Queue()
+        self.batcher = asyncio.create_task(self.gather())
+
+    async def close(self):
+        for task in list(self.connections):
+            task.cancel()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        if self.batcher is not None:
+            self.batcher.cancel()
+            await asyncio.gather(self.batcher, *self.batches, return_exceptions=True)
+            self.batcher = None
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    async def query(self, scene: str, point, max_distance=None, fov=None) -> tuple:
+        # (vertices, visible) of the viewpoint, as lists
+        if scene not in self.scenes:
+            raise ValueError(f"Unknown scene {scene!r}")
+        self.start()
+        key = scene, float(point[0]), float(point[1]), max_distance, None if fov is None else tuple(fov)
+        future = self.inflight.get(key)
+        if future is None:
+            future = self.inflight[key] = asyncio.get_running_loop().create_future()
+            self.queue.put_nowait(key)
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(future)
+
+    async def gather(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                if self.queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    batch.append(self.queue.get_nowait())
+            task = asyncio.create_task(self.run(batch))
+            self.batches.add(task)
+            task.add_done_callback(self.batches.discard)
+
+    async def run(self, batch: [tuple]):
+        self.batch_count += 1
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, compute_batch, batch)
+        except Exception as error:
+            results = [(False, f"{type(error).__name__}: {error}")] * len(batch)
+        for key, result in zip(batch, results):
+            future = self.inflight.pop(key)
+            self.computed += 1
+            if result[0]:
+                future.set_result(result[1:])
+            else:
+                future.set_exception(ValueError(result[1]))
+
+    def stats(self) -> dict:
+        latencies = np.array(self.latencies) * 1000
+        p50, p90, p99, worst = np.percentile(latencies, [50, 90, 99, 100]).tolist() if len(latencies) else [0.0] * 4
+        return {
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "inflight": len(self.inflight),
+            "batches_running": len(self.batches),
+            "requests": self.requests,
+            "computed": self.computed,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "batches": self.batch_count,
+            "mean_batch": self.computed / self.batch_count if self.batch_count else 0.0,
+            "latency_ms": {"p50": p50, "p90": p90, "p99": p99, "max": worst},
+        }
+
+    async def answer(self, request: dict) -> dict:
+        op = request.get("op", "query")
+        if op == "stats":
+            return {"stats": self.stats()}
+        if op == "scenes":
+            return {"scenes": sorted(self.scenes)}
+        if op != "query":
+            raise ValueError(f"Unknown op {op!r}")
+
+        start = time.perf_counter()
+        self.requests += 1
+        vertices, visible = await self.query(
+            request["scene"], request["point"], request.get("max_distance"), request.get("fov")
+        )
+        self.latencies.append(time.perf_counter() - start)
+        return {"vertices": vertices, "visible": visible}
+
+    async def respond(self, request, writer: asyncio.StreamWriter):
+        # any JSON value may arrive: one that isn't an object gets an error without an id
+        id = request.get("id") if isinstance(request, dict) else None
+        try:
+            if not isinstance(request, dict):
+                raise ValueError(f"Request must be a JSON object, got {type(request).__name__}")
+            response = {"ok": True, **await self.answer(request)}
+        except Exception as error:
+            self.errors += 1
+            response = {"ok": False, "error": str(error)}
+        write_message(writer, {"id": id, **response})
+        await writer.drain()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # one connection: every request is answered by a task of its own
+        pending = set()
+        self.connections.add(asyncio.current_task())
+        try:
+            while True:
+                try:
+                    request = await read_message(reader)
+                except EOFError:
+                    break
+                except ValueError as error:
+                    write_message(writer, {"id": None, "ok": False, "error": str(error)})
+                    break
+                task = asyncio.create_task(self.respond(request, writer))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            await asyncio.gather(*pending, return_exceptions=True)
+        except (asyncio.CancelledError, ConnectionError):
+            # the server is closing or the peer went away
+            for task in pending:
+                task.cancel()
+        finally:
+            self.connections.discard(asyncio.current_task())
+            writer.close()
+
+    async def serve_unix(self, path: str):
+        self.start()
+        server = await asyncio.start_unix_server(self.handle, path)
+        async with server:
+            await server.serve_forever()
+
+    async def serve_tcp(self, host="127.0.0.1", port=8765):
+        self.start()
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+class VisibilityClient:
+    """
+    Client of one connection, matching responses to requests by id so any
+    number of requests may be in flight at once.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader, self.writer = reader, writer
+        self.pending = {}
+        self.next_id = 0
+        self.listener = asyncio.create_task(self.listen())
+
+    @classmethod
+    async def connect_unix(cls, path: str) -> 'VisibilityClient':
+        return cls(*await asyncio.open_unix_connection(path))
+
+    @classmethod
+    async def connect_tcp(cls, host="127.0.0.1", port=8765) -> 'VisibilityClient':
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def listen(self):
+        while True:
+            try:
+                response = await read_message(self.reader)
+            except EOFError:
+                break
+            future = self.pending.pop(response["id"], None)
+            if future is not None:
+                future.set_result(response)
+        for future in self.pending.values():
+            future.set_exception(ConnectionError("Connection closed"))
+
+    async def request(self, message: dict) -> dict:
+        self.next_id += 1
+        future = self.pending[self.next_id] = asyncio.get_running_loop().create_future()
+        write_message(self.writer, {**message, "id": self.next_id})
+        await self.writer.drain()
+        response = await future
+        if not response["ok"]:
+            raise ValueError(response["error"])
+        return response
+
+    async def query(self, scene: str, point, max_distance=None, fov=None):
+        response = await self.request(
+            {"op": "query", "scene": scene, "point": list(point), "max_distance": max_distance, "fov": fov}
+        )
+        return response["vertices"], response["visible"]
+
+    async def stats(self) -> dict:
+        return (await self.request({"op": "stats"}))["stats"]
+
+    async def close(self):
+        self.writer.close()
+        await self.listener
+
+
+if __name__ == "__main__":
+    # a burst of requests from a few clients, many for the same viewpoints,
+    # against one blocking call per request
+    import random
+
+    from visual_objects import Polygon
+
+    polygons = []
+    for i in range(20, 1000, 50):
+        for j in range(20, 1000, 50):
+            polygons.append(Polygon([
+                Point(i, j),
+                Point(i + 10, j),
+                Point(i + 10, j + 10),
+                Point(i, j + 10),
+            ]))
+    scene = Scene(polygons)
+
+    random.seed(1)
+    hot = [(45.5 + 50 * random.randrange(19), 45.5 + 50 * random.randrange(19)) for _ in range(20)]
+    points = [random.choice(hot) for _ in range(300)]
+
+    start = time.perf_counter()
+    expected = {p: visibility_polygon(Point(*p), scene)[0].tolist() for p in set(points)}
+    blocking = (time.perf_counter() - start) / len(set(points)) * len(points)
+
+    async def main():
+        server = VisibilityServer({"map": scene}, workers=2, window=0.005)
+        listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        clients = [await VisibilityClient.connect_tcp("127.0.0.1", port) for _ in range(4)]
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(
+            clients[k % len(clients)].query("map", p) for k, p in enumerate(points)
+        ))
+        elapsed = time.perf_counter() - start
+        wrong = sum(vertices != expected[p] for p, (vertices, _) in zip(points, results))
+        try:
+            await clients[0].query("map", (-1e9, 0))
+        except ValueError as error:
+            print("outside the bounds:", error)
+        stats = await clients[0].stats()
+
+        for client in clients:
+            await client.close()
+        listener.close()
+        await listener.wait_closed()
+        await server.close()
+        print(f"{len(points)} requests: server={elapsed:.2f}s, blocking calls~{blocking:.2f}s, wrong {wrong}")
+        print(stats)
+
+    asyncio.run(main())
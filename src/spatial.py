@@ -0,0 +1,182 @@
+from math import floor
+
+import numpy as np
+
+# margin, in cells, by which a walk over a grid widens every segment, so
+# the cells it only touches at a side or a corner are walked too
+MARGIN = 1e-9
+
+
+def expand(starts: np.ndarray, counts: np.ndarray):
+    # for ranges starts[k]:starts[k] + counts[k], the range of every item and the item
+    owners = np.repeat(np.arange(len(counts)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owners, starts[owners] + local
+
+
+class Grid:
+    """
+    Uniform grid over segments given as rows ax, ay, bx, by. Every cell
+    lists the segments passing through it (or touching it), stored
+    CSR-style: cell c owns items[offsets[c]:offsets[c + 1]].
+    """
+
+    def __init__(self, segments: np.ndarray, box, cell=None):
+        ax, ay, bx, by = segments
+        min_x, min_y, max_x, max_y = box
+        width, height = max(max_x - min_x, 1e-9), max(max_y - min_y, 1e-9)
+        if cell is None:
+            # about one segment per cell
+            cell = max(width, height) if not len(ax) else np.sqrt(width * height / len(ax))
+
+        self.origin = min_x, min_y
+        self.cell = float(cell)
+        self.shape = int(width // cell) + 1, int(height // cell) + 1
+
+        cells, ids = self.__cover(ax, ay, bx, by)
+
+        order = np.argsort(cells, kind="stable")
+        self.items = ids[order]
+        counts = np.bincount(cells, minlength=self.shape[0] * self.shape[1])
+        self.offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.intp)
+
+    def cell_of(self, x, y):
+        nx, ny = self.shape
+        i = np.clip(np.floor((np.asarray(x) - self.origin[0]) / self.cell), 0, nx - 1).astype(np.intp)
+        j = np.clip(np.floor((np.asarray(y) - self.origin[1]) / self.cell), 0, ny - 1).astype(np.intp)
+        return i, j
+
+    def __cover(self, ax, ay, bx, by):
+        """
+        (cell, item) pairs for the cells every segment passes through: it
+        walks the columns of cells along its longer axis and covers, in
+        each, the rows it spans there. A segment crossing k cells gets
+        O(k) of them, not the k^2 of its bounding box when it's diagonal.
+        """
+        # in cell units: u along the longer axis, v along the other
+        gx0, gy0 = (ax - self.origin[0]) / self.cell, (ay - self.origin[1]) / self.cell
+        gx1, gy1 = (bx - self.origin[0]) / self.cell, (by - self.origin[1]) / self.cell
+        steep = np.abs(gy1 - gy0) > np.abs(gx1 - gx0)
+        a_u, a_v = np.where(steep, gy0, gx0), np.where(steep, gx0, gy0)
+        b_u, b_v = np.where(steep, gy1, gx1), np.where(steep, gx1, gy1)
+        columns = np.where(steep, self.shape[1], self.shape[0])
+        rows = np.where(steep, self.shape[0], self.shape[1])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            slope = np.where(b_u != a_u, (b_v - a_v) / (b_u - a_u), 0.0)
+
+        low_u, high_u = np.minimum(a_u, b_u), np.maximum(a_u, b_u)
+        first = np.clip(np.floor(low_u - MARGIN), 0, columns - 1).astype(np.intp)
+        last = np.clip(np.floor(high_u + MARGIN), 0, columns - 1).astype(np.intp)
+        ids, column = expand(first, last - first + 1)
+
+        # the part of the segment in its column and the rows it spans
+        start_u = np.maximum(low_u[ids], column - MARGIN)
+        end_u = np.minimum(high_u[ids], column + 1 + MARGIN)
+        start_v = a_v[ids] + (start_u - a_u[ids]) * slope[ids]
+        end_v = a_v[ids] + (end_u - a_u[ids]) * slope[ids]
+        row_max = rows[ids] - 1
+        bottom = np.clip(np.floor(np.minimum(start_v, end_v) - MARGIN), 0, row_max).astype(np.intp)
+        top = np.clip(np.floor(np.maximum(start_v, end_v) + MARGIN), 0, row_max).astype(np.intp)
+
+        owners, row = expand(bottom, top - bottom + 1)
+        ids, column = ids[owners], column[owners]
+        i = np.where(steep[ids], row, column)
+        j = np.where(steep[ids], column, row)
+        return i * self.shape[1] + j, ids
+
+    def walk(self, ax, ay, bx, by):
+        """
+        Items of the cells the segment a-b passes through, a column of
+        cells at a time from a, as (t, items): the segment leaves the
+        column at a + t * (b - a). An item may come up in several columns.
+        """
+        nx, ny = self.shape
+        if not len(self.items):
+            return
+        # clip_segments for the one segment, in floats
+        (min_x, min_y), t0, t1 = self.origin, 0.0, 1.0
+        max_x, max_y = min_x + nx * self.cell, min_y + ny * self.cell
+        for p, q in ((ax - bx, ax - min_x), (bx - ax, max_x - ax), (ay - by, ay - min_y), (by - ay, max_y - ay)):
+            if p == 0:
+                if q < 0:
+                    return
+            elif p < 0:
+                t0 = max(t0, q / p)
+            else:
+                t1 = min(t1, q / p)
+        if t0 > t1:
+            return
+        gx0, gy0 = (ax - self.origin[0]) / self.cell, (ay - self.origin[1]) / self.cell
+        gx1, gy1 = (bx - self.origin[0]) / self.cell, (by - self.origin[1]) / self.cell
+        steep = abs(gy1 - gy0) > abs(gx1 - gx0)
+        a_u, a_v, b_u, b_v = (gy0, gx0, gy1, gx1) if steep else (gx0, gy0, gx1, gy1)
+        columns, rows = (ny, nx) if steep else (nx, ny)
+        length = b_u - a_u
+        step = 1 if length >= 0 else -1
+
+        u0, u1 = a_u + t0 * length, a_u + t1 * length
+        first = min(max(floor(u0 - step * MARGIN), 0), columns - 1)
+        last = min(max(floor(u1 + step * MARGIN), 0), columns - 1)
+        for column in range(first, last + step, step):
+            # the part of the segment in the column and the rows it spans
+            near_u, far_u = (column, column + 1) if step > 0 else (column + 1, column)
+            if length:
+                start = max(t0, (near_u - step * MARGIN - a_u) / length)
+                end = min(t1, (far_u + step * MARGIN - a_u) / length)
+                leave = min(t1, (far_u - a_u) / length)
+            else:
+                start, end, leave = t0, t1, t1
+            low, high = sorted((a_v + start * (b_v - a_v), a_v + end * (b_v - a_v)))
+            rows_in = range(min(max(floor(low - MARGIN), 0), rows - 1), min(max(floor(high + MARGIN), 0), rows - 1) + 1)
+            cells = [row * ny + column if steep else column * ny + row for row in rows_in]
+            yield leave, np.concatenate([self.items[self.offsets[c]:self.offsets[c + 1]] for c in cells])
+
+    def query(self, min_x, min_y, max_x, max_y) -> np.ndarray:
+        # indices of the segments that may overlap the box, each once
+        (i0, i1), (j0, j1) = self.cell_of([min_x, max_x], [min_y, max_y])
+        cells = (np.arange(i0, i1 + 1)[:, None] * self.shape[1] + np.arange(j0, j1 + 1)).ravel()
+        if not len(self.items):
+            return self.items
+        parts = [self.items[self.offsets[c]:self.offsets[c + 1]] for c in cells.tolist()]
+        return np.unique(np.concatenate(parts)) if parts else self.items[:0]
+
+
+def clip_segments(segments: np.ndarray, box):
+    """
+    Liang-Barsky clipping of segments (rows ax, ay, bx, by) to a box.
+    Returns the parameters t0 <= t1 of the part inside the box, NaN for
+    segments that miss it.
+    """
+    ax, ay, bx, by = segments
+    min_x, min_y, max_x, max_y = box
+    dx, dy = bx - ax, by - ay
+    t0, t1 = np.zeros(len(ax)), np.ones(len(ax))
+    inside = np.ones(len(ax), dtype=bool)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for p, q in ((-dx, ax - min_x), (dx, max_x - ax), (-dy, ay - min_y), (dy, max_y - ay)):
+            parallel = p == 0
+            inside &= ~(parallel & (q < 0))
+            r = q / p
+            t0 = np.where(~parallel & (p < 0), np.maximum(t0, r), t0)
+            t1 = np.where(~parallel & (p > 0), np.minimum(t1, r), t1)
+
+    inside &= t0 <= t1
+    return np.where(inside, t0, np.nan), np.where(inside, t1, np.nan)
+
+
+def polygon_meets_box(segments: np.ndarray, box) -> bool:
+    """
+    Whether the closed polygon bounded by the segments (rows ax, ay, bx, by,
+    in any order) and the box share a point.
+    """
+    ax, ay, bx, by = segments
+    min_x, min_y, _, _ = box
+    starts, _ = clip_segments(segments, box)
+    if not np.all(np.isnan(starts)):
+        return True
+
+    # no side touches the box: it lies inside as a whole or not at all
+    with np.errstate(divide="ignore", invalid="ignore"):
+        crossing = ((ay > min_y) != (by > min_y)) & (min_x < ax + (min_y - ay) * (bx - ax) / (by - ay))
+    return bool(np.count_nonzero(crossing) % 2)
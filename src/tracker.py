@@ -0,0 +1,468 @@
+from heapq import heapify, heappop, heappush
+from math import pi, cos, sin, hypot
+
+import numpy as np
+
+from visual_objects import Point, Edge, Ray, Polygon, RayOrder, get_pseudo_angle
+from tree import Tree
+from scene import Scene
+from output import Output
+from predicates import orientation, orientations, direction, side
+from sight import crossing
+from vectorized import event_angles, active_flags, order_events, settle
+import visibility
+from visibility import get_scene, get_initial_ray, snap_ray
+
+
+class VisibilityTracker:
+    """
+    Visibility polygon of a moving viewpoint, kept as a kinetic structure:
+    the cyclic angular order of the vertices around the viewpoint (with the
+    two boundaries of a sector as fixed directions among them) and, per
+    vertex, the scene edge nearest the viewpoint just past it, the one the
+    sweep status has leftmost there.
+
+    The viewpoint stays inside the bounds rectangle, so neighbours in the
+    order are less than pi apart and two of them swap only when the
+    viewpoint crosses the line through them. Every pair of neighbours is
+    checked again once the viewpoint has travelled as far as that line
+    was, so a move looks at the pairs near its path only. A swap changes
+    the nearest edge past the two vertices and nowhere else, and those are
+    found again by walking the grid along their rays.
+
+    A move crossing an obstacle edge, an edit of the scene, or a move
+    longer than `max_step` sweeps again.
+    """
+
+    def __init__(self, point: Point, polygons: [Polygon], fov=None, tree_class=Tree, max_step=None):
+        self.scene = get_scene(point, polygons)
+        self.tree_class = tree_class
+        self.max_step = max_step
+
+        self.directions = []
+        if fov is not None and fov[1] < 2 * pi:
+            heading, angle = fov
+            if angle <= 0:
+                raise ValueError(f"Field of view angle must be positive, got {angle}")
+            min_x, min_y, max_x, max_y = self.scene.bounds_box
+            far = hypot(max_x - min_x, max_y - min_y)
+            self.directions = [(far * cos(heading - angle / 2), far * sin(heading - angle / 2)),
+                               (far * cos(heading + angle / 2), far * sin(heading + angle / 2))]
+
+        self.sweeps = self.updates = 0
+        self.recompute(point)
+
+    def rays(self, point: Point) -> [Ray]:
+        return [Ray(point, Point(point.x + dx, point.y + dy)) for dx, dy in self.directions]
+
+    def recompute(self, point: Point) -> [Edge]:
+        scene = self.scene
+        self.version = scene.version
+        self.vertices = scene.vertices
+        index = {id(vertex): i for i, vertex in enumerate(self.vertices)}
+        count = len(self.vertices)
+
+        # the full sweep, recording the status past every vertex
+        if self.directions:
+            rays = [snap_ray(ray, scene) for ray in self.rays(point)]
+            limit = get_pseudo_angle(point, rays[0].end, rays[1].end)
+        else:
+            rays, limit = [get_initial_ray(point, scene)], None
+        angles = event_angles(point, rays[0].end, scene)
+        order, swept = settle(point, rays[0].end, scene, angles, np.argsort(angles, kind="stable"), limit)
+        events = order_events(scene, order[:swept], active_flags(point, scene))
+        output, status = Output(trace=True), []
+        visibility.sweep_scene(scene, rays[0], rays[1] if limit is not None else None, self.tree_class,
+                               events, output, status)
+
+        # items 0..count - 1 are the vertices, a sector adds its start and end
+        order = order.tolist()
+        self.near = [None] * (count + len(self.directions))
+        for vertex, edge in status:
+            self.near[index[id(vertex)]] = edge
+        if self.directions:
+            order = [count] + order[:swept] + [count + 1] + order[swept:]
+        self.order = order
+        self.position = [0] * len(order)
+        for i, item in enumerate(order):
+            self.position[item] = i
+
+        # every pair of neighbours checked and scheduled, and the ray walked
+        # past the start of a sector: the sweep's boundaries are snapped to
+        # the vertices near them and may have put one on the wrong side
+        self.point, self.travel = point, 0.0
+        self.due, self.heap, self.collinear = {}, [], set()
+        dirty = self.repair(point, range(len(order)))
+        dirty.update(item for item in order if self.near[item] is None)
+        self.renew(point, dirty)
+        self.breaks = {item for item in range(count) if self.is_break(item)}
+
+        self.sweeps += 1
+        self.edges = list(output)
+        return self.edges
+
+    def move_to(self, point: Point) -> [Edge]:
+        if not self.scene.contains(point):
+            raise ValueError(f"Point {point} is outside of the scene bounds")
+        step = point.dist(self.point)
+        if (self.scene.version != self.version or (self.max_step is not None and step > self.max_step)
+                or self.blocked(self.point, point)):
+            return self.recompute(point)
+
+        # the pairs the viewpoint may have crossed the line of, and the ones
+        # left collinear by the last move, which separate now
+        self.travel += step
+        work = []
+        while self.heap and self.heap[0][0] <= self.travel:
+            deadline, first, second = heappop(self.heap)
+            if self.due.get(first) == (deadline, second) and self.following(first) == second:
+                del self.due[first]
+                work.append(self.position[first])
+        stale = self.collinear
+        self.collinear = set()
+        for item in stale:
+            work.append(self.position[item])
+
+        dirty = self.repair(point, work) | stale
+        self.renew(point, dirty)
+        for item in dirty | {self.following(item) for item in dirty}:
+            if item < len(self.vertices) and self.is_break(item):
+                self.breaks.add(item)
+            else:
+                self.breaks.discard(item)
+
+        if len(self.heap) > 4 * len(self.order):
+            self.heap = [(deadline, first, second) for first, (deadline, second) in self.due.items()]
+            heapify(self.heap)
+
+        self.updates += 1
+        self.point = point
+        self.edges = self.build(point)
+        return self.edges
+
+    def blocked(self, start: Point, end: Point) -> bool:
+        # whether the path of a move meets an obstacle edge, even at a
+        # point, or ends on one
+        ids = self.scene.grid.query(min(start.x, end.x), min(start.y, end.y), max(start.x, end.x), max(start.y, end.y))
+        if not len(ids):
+            return False
+        ax, ay, bx, by = self.scene.segments[:, ids]
+        on = ((orientations(ax, ay, bx, by, end.x, end.y) == 0)
+              & (np.minimum(ax, bx) <= end.x) & (end.x <= np.maximum(ax, bx))
+              & (np.minimum(ay, by) <= end.y) & (end.y <= np.maximum(ay, by)))
+        if on.any():
+            return True
+        if start.x == end.x and start.y == end.y:
+            return False
+        left, right = crossing(start.x, start.y, end.x, end.y, ax, ay, bx, by)
+        return bool((left | right).any())
+
+    def following(self, item: int) -> int:
+        return self.order[(self.position[item] + 1) % len(self.order)]
+
+    def previous(self, item: int) -> int:
+        return self.order[self.position[item] - 1]
+
+    def ray(self, point: Point, item: int) -> Ray:
+        # the ray from the point through a vertex or along a sector boundary
+        if item < len(self.vertices):
+            return Ray(point, self.vertices[item])
+        dx, dy = self.directions[item - len(self.vertices)]
+        return Ray(point, Point(point.x + dx, point.y + dy))
+
+    def precedes(self, first: int, second: int, point: Point):
+        """
+        Whether the item first comes right before the item second seen
+        from the point, and whether they lie on one ray. Vertices on one
+        ray go nearest first, the sector starts past the vertices on its
+        ray and ends before them.
+        """
+        count = len(self.vertices)
+        if first >= count and second >= count:
+            return True, False
+        if first >= count or second >= count:
+            boundary, vertex = (first, second) if first >= count else (second, first)
+            turn = side(self.ray(point, boundary), self.vertices[vertex])
+            if turn:
+                return (turn > 0) == (boundary == first), False
+            return (boundary == count + 1) == (boundary == first), True
+        a, b = self.vertices[first], self.vertices[second]
+        turn = orientation(point.x, point.y, a.x, a.y, b.x, b.y)
+        if turn:
+            return turn > 0, False
+        return point.dist(a) < point.dist(b), True
+
+    def slack(self, first: int, second: int, point: Point) -> float:
+        # how far the point is from the line the two items swap on
+        count = len(self.vertices)
+        if first >= count and second >= count:
+            return np.inf
+        if first >= count or second >= count:
+            boundary, vertex = (first, second) if first >= count else (second, first)
+            (dx, dy), v = self.directions[boundary - count], self.vertices[vertex]
+            return abs(dx * (v.y - point.y) - dy * (v.x - point.x)) / hypot(dx, dy)
+        a, b = self.vertices[first], self.vertices[second]
+        return abs((b.x - a.x) * (point.y - a.y) - (b.y - a.y) * (point.x - a.x)) / a.dist(b)
+
+    def repair(self, point: Point, work) -> set:
+        """
+        Swaps neighbours out of order from the point, starting at the
+        positions in `work`, until they're all in order, and schedules
+        every pair it checks. Returns the items swapped.
+        """
+        order, position, size = self.order, self.position, len(self.order)
+        work, dirty = list(work), set()
+        while work:
+            i = work.pop()
+            j = (i + 1) % size
+            first, second = order[i], order[j]
+            ahead, collinear = self.precedes(first, second, point)
+            if ahead:
+                # a pair left on one ray swaps as soon as the point moves
+                deadline = self.travel
+                if collinear:
+                    self.collinear.update((first, second))
+                else:
+                    deadline += self.slack(first, second, point) * (1 - 1e-9) - 1e-9
+                if self.due.get(first) != (deadline, second):
+                    self.due[first] = deadline, second
+                    heappush(self.heap, (deadline, first, second))
+                continue
+            order[i], order[j] = second, first
+            position[first], position[second] = j, i
+            dirty.update((first, second))
+            work += [(i - 1) % size, i, j]
+        return dirty
+
+    def inside(self, item: int) -> bool:
+        # whether the item lies in the sector, its start included
+        if not self.directions:
+            return True
+        start, size = self.position[len(self.vertices)], len(self.order)
+        offset = (self.position[item] - start) % size
+        return item == len(self.vertices) or 0 < offset < (self.position[len(self.vertices) + 1] - start) % size
+
+    def renew(self, point: Point, items):
+        """
+        Finds again the nearest edge past the items in the sector. The
+        status past a vertex is the one past the next vertex, with the
+        edges leaving that one ahead taken out and the ones coming to it
+        from behind put back, so each run of items is done from its end.
+        """
+        count = len(self.vertices)
+        pending = {item for item in items if item != count + 1 and self.inside(item)}
+        while pending:
+            run = [pending.pop()]
+            while self.following(run[-1]) in pending:
+                pending.remove(self.following(run[-1]))
+                run.append(self.following(run[-1]))
+            if self.following(run[-1]) == run[0]:
+                self.near[run[-1]] = self.shoot(point, run.pop())
+            for item in reversed(run):
+                self.near[item] = self.step_back(point, item)
+
+    def step_back(self, point: Point, item: int) -> Edge:
+        # the nearest edge past the item from the one past the next vertex:
+        # it stays while that vertex is hidden, one of the vertex's edges
+        # from behind takes over when it's visible, and the ray is walked
+        # when the nearest edge leaves the vertex or anything lies on its ray
+        following = self.following(item)
+        if following >= len(self.vertices) or self.precedes(item, following, point)[1]:
+            return self.shoot(point, item)
+        vertex, edge = self.vertices[following], self.near[following]
+        if edge.a is vertex or edge.b is vertex:
+            return self.shoot(point, item)
+        ray = Ray(point, vertex)
+        behind = []
+        for incident in self.scene.adjacency[vertex]:
+            turn = side(ray, incident.b if incident.a is vertex else incident.a)
+            if not turn:
+                return self.shoot(point, item)
+            if turn < 0:
+                behind.append(incident)
+        if not behind:
+            return edge
+        if not side(ray, edge.a) or not side(ray, edge.b):
+            return self.shoot(point, item)
+        distance, reach = point.dist(cut(point, vertex, edge)), point.dist(vertex)
+        if abs(distance - reach) <= 1e-9 * reach:
+            return self.shoot(point, item)
+        if reach > distance:
+            return edge
+        if len(behind) == 1 or RayOrder(ray).tie(behind[0], behind[1], vertex):
+            return behind[0]
+        return behind[1]
+
+    def shoot(self, point: Point, item: int) -> Edge:
+        """
+        The scene edge nearest the point just past the item, as the sweep
+        status has it: the vertices on the item's ray that come before it
+        are passed, their edges going ahead cross the ray, the ones after
+        it are not, their edges coming from behind do.
+        """
+        scene, count = self.scene, len(self.vertices)
+        ray = self.ray(point, item)
+        order = RayOrder(ray)
+        reach = point.dist(ray.end) if item < count else np.inf
+
+        def hit(edge: Edge):
+            # (distance, vertex) where the ray past the item meets the edge
+            ends = edge.a, edge.b
+            sides = [side(ray, end) for end in ends]
+            if not any(sides):
+                return None
+            turns = []
+            for end, turn in zip(ends, sides):
+                if not turn:
+                    if direction(point.x, point.y, ray.end.x, ray.end.y, end.x, end.y) <= 0:
+                        return None
+                    turn = -1 if end is ray.end or point.dist(end) < reach else 1
+                turns.append(turn)
+            if turns[0] == turns[1]:
+                return None
+            for end, turn in zip(ends, sides):
+                if not turn:
+                    return point.dist(end), end
+            right, left = ends if turns[0] < 0 else ends[::-1]
+            if orientation(right.x, right.y, left.x, left.y, point.x, point.y) <= 0:
+                return None
+            return point.dist(cut(point, ray.end, edge)), None
+
+        best = None
+
+        def consider(edge: Edge):
+            nonlocal best
+            found = hit(edge)
+            if found is None:
+                return
+            if best is not None:
+                (distance, z), (best_distance, best_z) = found, best[:2]
+                if z is not None and z is best_z:
+                    if not order.tie(edge, best[2], z):
+                        return
+                elif distance >= best_distance:
+                    return
+            best = (*found, edge)
+
+        min_x, min_y, max_x, max_y = scene.bounds_box
+        scale = max(reach if reach < np.inf else 0.0, hypot(max_x - min_x, max_y - min_y)) / point.dist(ray.end)
+        end = Point(point.x + (ray.end.x - point.x) * scale, point.y + (ray.end.y - point.y) * scale)
+        length = point.dist(end)
+        for leave, ids in scene.grid.walk(point.x, point.y, end.x, end.y):
+            for i in ids.tolist():
+                consider(scene.edges[i])
+            if best is not None and best[0] < leave * length:
+                return best[2]
+        for edge in scene.edges[scene.obstacles:]:
+            consider(edge)
+        return best[2]
+
+    def is_break(self, item: int) -> bool:
+        # whether the nearest edge changes at a vertex of the sector
+        return (item != len(self.vertices) and self.inside(item)
+                and self.near[self.previous(item)] is not self.near[item])
+
+    def place(self, point: Point, item: int, edge: Edge) -> Point:
+        # where the item's ray meets the edge: the vertex itself, or an end
+        # of the edge on the ray, or a new point
+        ray = self.ray(point, item)
+        for end in (edge.a, edge.b):
+            if end is ray.end or (not side(ray, end)
+                                  and direction(point.x, point.y, ray.end.x, ray.end.y, end.x, end.y) > 0):
+                return end
+        return cut(point, ray.end, edge)
+
+    def build(self, point: Point) -> [Edge]:
+        """
+        The polygon from the breaks in the nearest edge, counterclockwise:
+        between two breaks a piece of the edge, at a break the invisible
+        step along its ray from one edge to the next.
+        """
+        count, size = len(self.vertices), len(self.order)
+        edges = []
+
+        def step(a: Point, b: Point, visible: bool):
+            if a.x != b.x or a.y != b.y:
+                edges.append(Edge(a, b, visible=visible))
+
+        if self.directions:
+            start = self.position[count]
+            breaks = sorted(self.breaks, key=lambda item: (self.position[item] - start) % size)
+            edge = self.near[count]
+            z = self.place(point, count, edge)
+            step(point, z, False)
+        else:
+            breaks = sorted(self.breaks, key=self.position.__getitem__)
+            edge = self.near[breaks[-1]]
+            z = first = self.place(point, breaks[0], edge)
+
+        for item in breaks:
+            end = self.place(point, item, edge)
+            step(z, end, edge.visible)
+            edge = self.near[item]
+            z = self.place(point, item, edge)
+            step(end, z, False)
+
+        if self.directions:
+            end = self.place(point, count + 1, edge)
+            step(z, end, edge.visible)
+            step(end, point, False)
+        else:
+            step(z, first, edge.visible)
+        return edges
+
+    def ring(self):
+        # the current polygon as Output.ring gives it
+        output = Output()
+        for edge in self.edges:
+            output.append(edge)
+        return output.ring()
+
+
+def cut(point: Point, through: Point, edge: Edge) -> Point:
+    # where the line from the point through `through` meets the edge
+    a, b = edge.a, edge.b
+    dx, dy, ex, ey = through.x - point.x, through.y - point.y, b.x - a.x, b.y - a.y
+    t = (dx * (a.y - point.y) - dy * (a.x - point.x)) / (dy * ex - dx * ey)
+    t = min(1.0, max(0.0, t))
+    return Point(a.x + t * ex, a.y + t * ey)
+
+
+if __name__ == "__main__":
+    # an agent walking across a map: tracker against a full sweep per tick
+    import random
+    import time
+
+    from visibility import asano_algorithm
+
+    polygons = []
+    for i in range(20, 1000, 50):
+        for j in range(20, 1000, 50):
+            polygons.append(Polygon([
+                Point(i, j),
+                Point(i + 10, j),
+                Point(i + 10, j + 10),
+                Point(i, j + 10),
+            ]))
+    scene = Scene(polygons)
+
+    for step in (0.5, 0.1, 0.02):
+        random.seed(1)
+        path, x, y = [], 3.3, 7.7
+        for _ in range(200):
+            x, y = x + random.uniform(0, step), y + random.uniform(0, step)
+            path.append(Point(x, y))
+
+        start = time.perf_counter()
+        for point in path:
+            asano_algorithm(point, scene)
+        full = time.perf_counter() - start
+
+        tracker = VisibilityTracker(path[0], scene)
+        start = time.perf_counter()
+        for point in path[1:]:
+            tracker.move_to(point)
+        tracked = time.perf_counter() - start
+
+        print(f"step={step} ticks={len(path)} full={full:.3f}s tracker={tracked:.3f}s "
+              f"sweeps={tracker.sweeps} updates={tracker.updates}")
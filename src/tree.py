@@ -1,138 +1,254 @@
-from visual_objects import Point, Edge, Ray, is_closer
+from visual_objects import Point, Edge, Ray, ray_order
+
+RED, BLACK = True, False
+
 
 class Node:
-    def __init__(self, edge, distance):
+    __slots__ = ("edge", "d", "right", "left", "parent", "color")
+
+    def __init__(self, edge, distance=None):
         self.edge = edge
         self.d = distance
         self.right = None
         self.left = None
+        self.parent = None
+        self.color = BLACK
+
+    def __eq__(self, other):
+        return isinstance(other, Node) and self.edge == other.edge
 
     def update(self, node: 'Node'):
         self.edge = node.edge
         self.d = node.d
 
+
 class Tree:
+    """
+    Red-black tree of the edges crossed by the sweep ray, ordered by
+    distance from the ray start. Nodes are also indexed by edge, so delete
+    and update never have to compare edges that touch the current vertex.
+    """
 
     def __init__(self, nodes):
-        self.root = self.__from_sorted(0, len(nodes) - 1,  nodes)
-      
+        self.nil = Node(None)
+        self.nodes = {}
+        height = len(nodes).bit_length() - 1
+        self.root = self.__from_sorted(0, len(nodes) - 1, nodes, 0, height)
+        self.root.parent = self.nil
 
-    def __from_sorted(self, start, end, nodes):
+    def __from_sorted(self, start, end, nodes, depth, height):
         if start > end:
-            return None
+            return self.nil
 
         mid = (start + end) // 2
         node = nodes[mid]
-        node.left = self.__from_sorted(start,   mid - 1,  nodes)
-        node.right  = self.__from_sorted(mid + 1, end,      nodes)
+        node.left = self.__from_sorted(start, mid - 1, nodes, depth + 1, height)
+        node.right = self.__from_sorted(mid + 1, end, nodes, depth + 1, height)
+        node.left.parent = node.right.parent = node
+        # every path has `height` black nodes, only the incomplete last level is red
+        node.color = RED if depth == height and depth > 0 else BLACK
+        self.nodes[node.edge] = node
 
         return node
 
-    def update_dist(self, node, ray):
-        if node is None:return
-
-        point = ray.intersect(node.edge)
-        if point is None:
-            raise ValueError(f"Strange situation Ray[{ray.start}, {ray.end}] and {node.edge} doesn't have intersection point")
-
-        node.d = ray.start.dist(point)
-    
     @property
     def is_empty(self):
-        return self.root is None
+        return self.root is self.nil
 
     @property
     def leftmost(self):
-        if self.root is None:
+        if self.root is self.nil:
             return None
         return self.__leftmost(self.root)
 
     def __leftmost(self, node):
-        if not node.left:
-            return node
-        return self.__leftmost(node.left)
+        while node.left is not self.nil:
+            node = node.left
+        return node
 
     def insert(self, node: Node, ray: Ray):
-        if self.root is  None:
+        order = ray_order(ray)
+        parent, current, closer = self.nil, self.root, False
+        while current is not self.nil:
+            parent = current
+            closer = order.closer(node.edge, current.edge)
+            current = current.left if closer else current.right
+
+        node.parent = parent
+        node.left = node.right = self.nil
+        node.color = RED
+        if parent is self.nil:
             self.root = node
+        elif closer:
+            parent.left = node
         else:
-            self.__insert(node, self.root, ray)
-    
-    def __insert(self, node: Node, root: Node, ray: Ray):
-        #self.update_dist(node, ray)
-        #self.update_dist(root, ray)
-
-        if is_closer(node.edge, root.edge, ray):
-            if root.left is None:
-                root.left = node
-            else:
-                self.__insert(node, root.left, ray)
-        else:
-            if root.right is None:
-                root.left = node
-            else:
-                self.__insert(node, root.right, ray)
+            parent.right = node
 
-    def delete(self, node: Node, ray: Ray):
-        self.root = self.__delete(node, self.root, ray)
-
-    def __delete(self, node: Node, root: Node, ray: Ray):
-        self.update_dist(node, ray)
-        self.update_dist(root, ray)
-
-        if root is None:
-            return root
-
-        if node.edge == root.edge:
-            if root.left is None:
-                return root.right
-            elif root.right is None:
-                return root.left
-            
-            root.edge = self.__leftmost(root.right).edge
-            root.right = self.__delete(node, root.right, ray)
-        
-        elif node.d < root.d:
-            root.right = self.__delete(node, root.right, ray)
-        elif node.left:
-            root.left = self.__delete(node, root.left, ray)
-        return root
+        self.nodes[node.edge] = node
+        self.__insert_fixup(node)
 
-    def update(self, old: Node, new: Node, ray: Ray):
-        self.__update(old, new, self.root, ray)
+    def delete(self, node: Node, ray: Ray):
+        node = self.nodes.pop(node.edge, None)
+        if node is None:
+            return
 
-    def __update(self, old: Node, new: Node, root: Node, ray: Ray):
-        #self.update_dist(old, ray)
-        #self.update_dist(new, ray)
-        #self.update_dist(root, ray)
+        removed_color = node.color
+        if node.left is self.nil:
+            child = node.right
+            self.__replace_child(node, child)
+        elif node.right is self.nil:
+            child = node.left
+            self.__replace_child(node, child)
+        else:
+            successor = self.__leftmost(node.right)
+            removed_color = successor.color
+            child = successor.right
+            if successor.parent is node:
+                child.parent = successor
+            else:
+                self.__replace_child(successor, successor.right)
+                successor.right = node.right
+                successor.right.parent = successor
+            self.__replace_child(node, successor)
+            successor.left = node.left
+            successor.left.parent = successor
+            successor.color = node.color
 
+        if removed_color == BLACK:
+            self.__delete_fixup(child)
 
-        if root is None:
+    def update(self, old: Node, new: Node, ray: Ray):
+        node = self.nodes.pop(old.edge, None)
+        if node is None:
             return
-        
-        if root.edge == old.edge:
-            return root.update(new)
-            
-        if is_closer(old.edge, root.edge, ray) and root.left:
-            self.__update(old, new, root.left, ray)
-        elif not is_closer(old.edge, root.edge, ray) and root.right:
-            self.__update(old, new, root.right, ray)
+        node.update(new)
+        self.nodes[node.edge] = node
+
+    def __rotate_left(self, node: Node):
+        child = node.right
+        node.right = child.left
+        if child.left is not self.nil:
+            child.left.parent = node
+        self.__replace_child(node, child)
+        child.left = node
+        node.parent = child
+
+    def __rotate_right(self, node: Node):
+        child = node.left
+        node.left = child.right
+        if child.right is not self.nil:
+            child.right.parent = node
+        self.__replace_child(node, child)
+        child.right = node
+        node.parent = child
+
+    def __replace_child(self, node: Node, child: Node):
+        child.parent = node.parent
+        if node.parent is self.nil:
+            self.root = child
+        elif node is node.parent.left:
+            node.parent.left = child
+        else:
+            node.parent.right = child
+
+    def __insert_fixup(self, node: Node):
+        while node.parent.color == RED:
+            parent = node.parent
+            grandparent = parent.parent
+            if parent is grandparent.left:
+                uncle = grandparent.right
+                if uncle.color == RED:
+                    parent.color = uncle.color = BLACK
+                    grandparent.color = RED
+                    node = grandparent
+                    continue
+                if node is parent.right:
+                    node = parent
+                    self.__rotate_left(node)
+                    parent = node.parent
+                parent.color = BLACK
+                grandparent.color = RED
+                self.__rotate_right(grandparent)
+            else:
+                uncle = grandparent.left
+                if uncle.color == RED:
+                    parent.color = uncle.color = BLACK
+                    grandparent.color = RED
+                    node = grandparent
+                    continue
+                if node is parent.left:
+                    node = parent
+                    self.__rotate_right(node)
+                    parent = node.parent
+                parent.color = BLACK
+                grandparent.color = RED
+                self.__rotate_left(grandparent)
+        self.root.color = BLACK
+
+    def __delete_fixup(self, node: Node):
+        while node is not self.root and node.color == BLACK:
+            parent = node.parent
+            if node is parent.left:
+                sibling = parent.right
+                if sibling.color == RED:
+                    sibling.color = BLACK
+                    parent.color = RED
+                    self.__rotate_left(parent)
+                    sibling = parent.right
+                if sibling.left.color == BLACK and sibling.right.color == BLACK:
+                    sibling.color = RED
+                    node = parent
+                    continue
+                if sibling.right.color == BLACK:
+                    sibling.left.color = BLACK
+                    sibling.color = RED
+                    self.__rotate_right(sibling)
+                    sibling = parent.right
+                sibling.color = parent.color
+                parent.color = BLACK
+                sibling.right.color = BLACK
+                self.__rotate_left(parent)
+                node = self.root
+            else:
+                sibling = parent.left
+                if sibling.color == RED:
+                    sibling.color = BLACK
+                    parent.color = RED
+                    self.__rotate_right(parent)
+                    sibling = parent.left
+                if sibling.left.color == BLACK and sibling.right.color == BLACK:
+                    sibling.color = RED
+                    node = parent
+                    continue
+                if sibling.left.color == BLACK:
+                    sibling.right.color = BLACK
+                    sibling.color = RED
+                    self.__rotate_left(sibling)
+                    sibling = parent.left
+                sibling.color = parent.color
+                parent.color = BLACK
+                sibling.left.color = BLACK
+                self.__rotate_right(parent)
+                node = self.root
+        node.color = BLACK
+
 
 if __name__ == "__main__":
     ray = Ray(
         start=Point(1, 1),
         end=Point(2, 2))
-        
+
     edges = [
         Edge(Point(3, 1), Point(1, 3)),
         Edge(Point(4, 2), Point(2, 4)),
         Edge(Point(5, 3), Point(3, 5)),
-        Edge(Point(6, 4), Point(4, 6)),
         Edge(Point(7, 5), Point(5, 7)),
         Edge(Point(8, 6), Point(6, 8)),
         Edge(Point(9, 7), Point(7, 9)),
     ]
-
+    e = Edge(Point(6, 4), Point(4, 6))
     nodes = [Node(e, ray.intersect_dist(e)) for e in edges]
     tree = Tree(nodes)
+    tree.insert(Node(e), ray)
+    tree.delete(Node(edges[0]), ray)
     print(tree.leftmost.edge)
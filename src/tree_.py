@@ -1,4 +1,4 @@
-from visual_objects import Point, Edge, Ray, is_closer
+from visual_objects import Point, Edge, Ray, ray_order
 
 class Node:
     def __init__(self, edge, distance=None):
@@ -28,13 +28,14 @@ class Tree:
     def insert(self, node: Node, ray: Ray):
         if not self.nodes:
             return
+        order = ray_order(ray)
         first = self.nodes[0]
-        if is_closer(node.edge, first.edge, ray):
+        if order.closer(node.edge, first.edge):
             self.nodes[0:0] = [node]
             return
 
         for i, second in enumerate(self.nodes[1:]):
-            if is_closer(first.edge, node.edge, ray) and is_closer(node.edge, second.edge, ray):
+            if order.closer(first.edge, node.edge) and order.closer(node.edge, second.edge):
                 self.nodes[i+1:i+1] = [node]
                 return
             first = second
@@ -0,0 +1,183 @@
+import numpy as np
+
+from visual_objects import Point, Edge, Ray, eps
+from tree import Tree, Node
+from scene import Scene, vertex_edges
+from predicates import side, orientations, exact_angle, exact_distance
+
+# float pseudo-angles closer than this may be in the wrong order or
+# apart where the exact ones are equal (their error is around 1e-15)
+TIE = 1e-9
+
+# event flags by the value of active_flags
+FLAGS = (False, True, None)
+
+
+def ray_hits(ray: Ray, segments: np.ndarray):
+    """
+    Ray parameters t of the hits of `ray` with every segment (hit point is
+    start + t * (end - start)), NaN where the ray misses the segment.
+    """
+    ax, ay, bx, by = segments
+    x, y = ray.start.x, ray.start.y
+    dx, dy = ray.end.x - x, ray.end.y - y
+    ex, ey = bx - ax, by - ay
+    wx, wy = ax - x, ay - y
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        d = dx * ey - dy * ex
+        t = (wx * ey - wy * ex) / d
+        u = (wx * dy - wy * dx) / d
+        # same slack as Edge.contains, measured along the edge
+        slack = eps / np.hypot(ex, ey)
+
+    hit = (d != 0) & (t >= 0) & (u >= -slack) & (u <= 1 + slack)
+    return np.where(hit, t, np.nan)
+
+
+def sort_edges(ray: Ray, scene: Scene):
+    t = ray_hits(ray, scene.segments)
+    order = np.argsort(t, kind="stable")[:np.count_nonzero(~np.isnan(t))]
+    if not len(order):
+        raise ValueError("No intersections")
+
+    x, y = ray.start.x, ray.start.y
+    dx, dy = ray.end.x - x, ray.end.y - y
+    t = t[order]
+    edges = [scene.edges[i] for i in order.tolist()]
+    distances = (t * np.hypot(dx, dy)).tolist()
+    points = [Point(px, py) for px, py in zip((x + t * dx).tolist(), (y + t * dy).tolist())]
+    return edges, distances, points
+
+
+def split_edge(edge: Edge, point: Point, ray: Ray, scene: Scene, overrides: dict, output=None):
+    """
+    Splits an edge crossed by the initial ray at the crossing. The part
+    ahead of the ray starts in the status, the part behind it is swept
+    last and enters at its own vertex, so the output never holds the edge
+    twice. Returns the part that goes into the initial status, or None for
+    an edge that only touches the ray: its vertex events handle it.
+    """
+    side_a, side_b = side(ray, edge.a), side(ray, edge.b)
+    if side_a * side_b >= 0:
+        return None
+
+    ahead, behind = (edge.a, edge.b) if side_a > 0 else (edge.b, edge.a)
+    ahead_part = Edge(point, ahead, visible=edge.visible)
+    behind_part = Edge(behind, point, visible=edge.visible)
+    if output is not None:
+        output.trace(point, edge, ray)
+        output.part(ahead_part, edge)
+        output.part(behind_part, edge)
+    for vertex, part in ((ahead, ahead_part), (behind, behind_part)):
+        overrides[vertex] = tuple(part if other is edge else other
+                                  for other in vertex_edges(scene, overrides, vertex))
+    return ahead_part
+
+
+def initial_status(ray: Ray, scene: Scene, tree_class=Tree, output=None):
+    """
+    Status tree for the initial ray and the per-query vertex -> edges
+    overrides made by splitting the crossed edges, traced in `output`.
+    """
+    overrides, nodes = {}, []
+    for edge, dist, point in zip(*sort_edges(ray, scene)):
+        edge = split_edge(edge, point, ray, scene, overrides, output)
+        if edge is not None:
+            nodes.append(Node(edge, dist))
+    return tree_class(nodes), overrides
+
+
+def pseudo_angles(x: np.ndarray, y: np.ndarray):
+    # vectorized visual_objects.pseudo_angle
+    total = np.abs(x) + np.abs(y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(total == 0, 1.0, x / total)
+    return np.where(y < 0, 3 + ratio, 1 - ratio)
+
+
+def event_angles(point: Point, ray_point: Point, scene: Scene) -> np.ndarray:
+    # pseudo-angle of every scene vertex around `point`, from the direction to `ray_point`
+    x, y = scene.coordinates
+    vx, vy = x - point.x, y - point.y
+    rx, ry = ray_point.x - point.x, ray_point.y - point.y
+    return pseudo_angles(vx * rx + vy * ry, rx * vy - ry * vx)
+
+
+def active_flags(point: Point, scene: Scene) -> np.ndarray:
+    """
+    Per column of scene.adjacent: 1 if the far endpoint lies clockwise
+    from the vertex or straight behind the viewpoint (the edge is already
+    swept), 0 if it lies counterclockwise, -1 if the edge lies along the
+    ray from the viewpoint: it has no width to the sweep, which skips it.
+    """
+    x, y = scene.coordinates
+    vx, vy = x[scene.owners], y[scene.owners]
+    ox, oy = scene.adjacent
+    turn = orientations(point.x, point.y, vx, vy, ox, oy)
+    behind = (vx - point.x) * (ox - point.x) + (vy - point.y) * (oy - point.y) < 0
+    return np.where(turn < 0, 1, np.where(turn > 0, 0, np.where(behind, 1, -1))).astype(np.int8)
+
+
+def order_events(scene: Scene, order: np.ndarray, active: np.ndarray):
+    # (vertex, flags of its edges in scene.adjacency order) for the vertex
+    # indices in `order`, a flag being True, False or None as in FLAGS
+    vertices, offsets = scene.vertices, scene.offsets.tolist()
+    active = [FLAGS[flag] for flag in active.tolist()]
+    return [(vertices[i], tuple(active[offsets[i]:offsets[i + 1]])) for i in order.tolist()]
+
+
+def settle(point: Point, ray_point: Point, scene: Scene, angles: np.ndarray, order: np.ndarray, limit=None):
+    """
+    Re-sorts the runs of `order` (sorted by the float `angles`) that the
+    floats can't be trusted on by exact pseudo-angle, and the vertices on
+    one ray from `point` by distance, nearest first. Vertices at angles
+    near 0 and near 4 are sorted together: exactly they may be either.
+    Returns the order and how many of its vertices lie below `limit`.
+    """
+    ordered = angles[order]
+    close = np.diff(ordered) <= TIE
+    uncertain = (ordered <= TIE) | (ordered >= 4 - TIE)
+    uncertain[:-1] |= close
+    uncertain[1:] |= close
+    if not uncertain.any():
+        return order, len(order) if limit is None else int(np.searchsorted(ordered, limit))
+
+    x, y = scene.coordinates
+
+    def exact(members):
+        keys = [(exact_angle(point.x, point.y, ray_point.x, ray_point.y, x[i], y[i]),
+                 exact_distance(point.x, point.y, x[i], y[i]), i) for i in members.tolist()]
+        keys.sort()
+        return keys
+
+    positions = np.flatnonzero(uncertain)
+    runs = np.split(positions, np.flatnonzero(np.diff(positions) > 1) + 1)
+    order = order.copy()
+    first = len(runs[0]) if runs[0][0] == 0 else 0
+    last = len(runs[-1]) if runs[-1][-1] == len(order) - 1 and (first == 0 or len(runs) > 1) else 0
+    for run in runs[bool(first):len(runs) - bool(last)]:
+        order[run] = [i for _, _, i in exact(order[run])]
+
+    ends = exact(np.concatenate((order[:first], order[len(order) - last:])))
+    front = [i for angle, _, i in ends if angle < 2]
+    back = [i for angle, _, i in ends if angle >= 2]
+    middle = order[first:len(order) - last]
+    order = np.concatenate((front, middle, back)).astype(order.dtype)
+    if limit is None:
+        return order, len(order)
+    # a sector ends before the vertices just behind its start
+    return order, len(front) + int(np.searchsorted(angles[middle], limit))
+
+
+def sort_events(point: Point, ray_point: Point, scene: Scene, limit=None):
+    """
+    Scene vertices in sweep order around `point`, starting from the
+    direction to `ray_point`, each with a tuple of flags telling which of
+    its edges (in scene.adjacency order) are active, i.e. already swept,
+    None for edges along a ray from `point`. With `limit` only the
+    vertices at pseudo-angles below it are swept.
+    """
+    angles = event_angles(point, ray_point, scene)
+    order, count = settle(point, ray_point, scene, angles, np.argsort(angles, kind="stable"), limit)
+    return order_events(scene, order[:count], active_flags(point, scene))
@@ -1,68 +1,64 @@
-from visual_objects import Ray, Polygon, Edge, Point, get_angle, is_closer
-from math import pi
-from tree_ import Tree, Node
-
-
-def get_intersections(ray: Ray, polygons: [Polygon]):
-    output = []
-    for polygon in polygons:
-        output += [(ray.intersect(edge), edge)
-                   for edge in polygon.edges if ray.intersect(edge)]
-    return output
-
-
-def get_initial_ray(point: Point, polygons: [Polygon]):
-    a, b = polygons[0].points[:2]
-    median = Point((a.x + b.x) / 2, (a.y + b.y) / 2)
-    return Ray(point, median)
-
-
-def init_tree(edges, ray) -> Tree:
-    nodes = []
-    for edge in edges:
-        assert_edge(ray, edge)
-        dist = ray.start.dist(ray.intersect(edge))
-        nodes.append(Node(edge, dist))
-
-    return Tree(nodes)
-
-
-def sort_vertices(point: Point, ray_point: Point, polygons: [Polygon]):
-    vertices = []
-    for polygon in polygons:
-        vertices += polygon.points
-
-    vertices.sort(key=lambda p: get_angle(point, ray_point, p))
-    return vertices
-
-
-def add_bounds(point: Point, polygons: [Polygon]) -> Polygon:
-    points = [point]
-    for polygon in polygons:
-        points += polygon.points
-    
-    max_x = max(points, key=lambda p: p.x).x + 20
-    min_x = min(points, key=lambda p: p.x).x - 20
-    max_y = max(points, key=lambda p: p.y).y + 20
-    min_y = min(points, key=lambda p: p.y).y - 20
-    polygon = Polygon([
-        Point(min_x, min_y),
-        Point(max_x, min_y),
-        Point(max_x, max_y),
-        Point(min_x, max_y),
-    ], visible=False)
-    return  polygons + [polygon]
-
-def is_active_edge(point: Point, vertex: Point, edge: Edge):
-    other = edge.get_other(vertex)
-    return get_angle(point, vertex, other) >= pi
-
-def sort_edges(ray, polygons):
+from visual_objects import Ray, RayOrder, Polygon, Edge, Point, get_pseudo_angle, is_closer, eps
+from math import pi, cos, sin, hypot
+import numpy as np
+from tree import Tree, Node
+from scene import Scene, vertex_edges
+from vectorized import initial_status, sort_events
+from output import Output
+from predicates import side, on_ray
+from region import VisibilityRegion
+
+
+def get_initial_ray(point: Point, scene: Scene):
+    # a ray through no vertex, so no edge lies along it or ends on it: the
+    # bisector of the widest angle between the directions to the vertices,
+    # at least 2 pi / n wide, far beyond the float error of the angles
+    x, y = scene.coordinates
+    angles = np.sort(np.arctan2(y - point.y, x - point.x))
+    gaps = np.diff(np.append(angles, angles[0] + 2 * pi))
+    widest = int(np.argmax(gaps))
+    direction = float(angles[widest] + gaps[widest] / 2)
+    min_x, min_y, max_x, max_y = scene.bounds_box
+    far = hypot(max_x - min_x, max_y - min_y)
+    return Ray(point, Point(point.x + far * cos(direction), point.y + far * sin(direction)))
+
+
+def get_sector_rays(point: Point, scene: Scene, fov):
+    # rays along both boundaries of the cone of vision, in sweep order
+    heading, angle = fov
+    if angle <= 0:
+        raise ValueError(f"Field of view angle must be positive, got {angle}")
+    min_x, min_y, max_x, max_y = scene.bounds_box
+    far = hypot(max_x - min_x, max_y - min_y)
+    rays = [Ray(point, Point(point.x + far * cos(direction), point.y + far * sin(direction)))
+            for direction in (heading - angle / 2, heading + angle / 2)]
+    return [snap_ray(ray, scene) for ray in rays]
+
+
+def snap_ray(ray: Ray, scene: Scene):
+    # a boundary passing within eps of a vertex goes exactly through it:
+    # the edges it would cut next to the vertex would be cut at a point
+    # equal to the vertex, and the pieces left would have no length
     point = ray.start
-    intersections = get_intersections(ray, polygons)
-    intersections.sort(key=lambda inter: point.dist(inter[0]))
-    edges = [edge for point, edge in intersections]
-    return edges, intersections[0][0]
+    x, y = scene.coordinates
+    vx, vy = x - point.x, y - point.y
+    rx, ry = ray.end.x - point.x, ray.end.y - point.y
+    off = np.abs(rx * vy - ry * vx) / hypot(rx, ry)
+    off[(rx * vx + ry * vy <= 0) | ((vx == 0) & (vy == 0))] = np.inf
+    nearest = int(np.argmin(off))
+    if off[nearest] > eps:
+        return ray
+    return Ray(point, scene.vertices[nearest])
+
+
+def get_scene(point: Point, polygons, max_distance=None) -> Scene:
+    if not isinstance(polygons, Scene):
+        polygons = Scene(polygons, [point])
+    elif not polygons.contains(point):
+        raise ValueError(f"Point {point} is outside of the scene bounds")
+    if max_distance is not None:
+        return polygons.around(point, max_distance)
+    return polygons
 
 def assert_edge(ray: Ray, edge: Edge):
     if not ray.intersect(edge):
@@ -94,46 +90,56 @@ def insert(tree: Tree, edge: Edge, ray: Ray):
 
 #     output.append(Edge(z, vertex))
 
-def construct_end_edge(output: [Edge], tree: Tree, leftmost: Node, ray: Ray):
+def construct_end_edge(output: Output, tree: Tree, leftmost: Node, ray: Ray):
     # insert, insert
     vertex = ray.end
     
-    z = ray.intersect(leftmost.edge)
+    z = output.cut(ray, leftmost.edge)
     if z is None:
         raise ValueError("No intersections")
     
     new_edge = Edge(z, vertex, visible=False)
     if leftmost.edge in output:
-        output.remove(leftmost.edge)
-        # finding right point for construct edge with point z
-        x, y = leftmost.edge.get_points()
-        n = x if get_angle(ray.start, ray.end, x) > get_angle(ray.start, ray.end, y) else y
-        output.append(Edge(n, z, visible=leftmost.edge.visible))
+        cut_visible_part(output, leftmost.edge, z, ray)
 
     output.append(new_edge)
+
+
+def cut_visible_part(output: Output, edge: Edge, z: Point, ray: Ray):
+    # the edge is hidden from z on: its visible part runs from its end
+    # already swept, none if the edge starts on the ray
+    behind = [end for end in (edge.a, edge.b) if side(ray, end) < 0]
+    if behind:
+        output.replace(edge, Edge(behind[0], z, visible=edge.visible))
+    else:
+        output.remove(edge)
     
 
-def construct_begin_edge(output: [Edge], tree: Tree, vertices: [Point], ray: Ray):
+def construct_begin_edge(output: Output, tree: Tree, scene: Scene, overrides: dict, ray: Ray):
     vertex = ray.end
     leftmost = tree.leftmost
 
-    z = ray.intersect(leftmost.edge)
+    z = output.cut(ray, leftmost.edge)
     if z is None:
         raise ValueError("No intersections")
 
-    # finding right point for construct edge with point z
-    x, y = leftmost.edge.get_points()
-    n = x if get_angle(ray.start, ray.end, x) < get_angle(ray.start, ray.end, y) else y
-
-    partial_edge = Edge(n, z, visible=leftmost.edge.visible)
+    # the edge is visible from z to its end still ahead; one ending on the
+    # ray (at a farther vertex swept next) keeps just that end
+    ahead = [end for end in (leftmost.edge.a, leftmost.edge.b) if side(ray, end) > 0]
+    if ahead:
+        n, partial_edge = ahead[0], Edge(ahead[0], z, visible=leftmost.edge.visible)
+    else:
+        n = leftmost.edge.a if on_ray(ray, leftmost.edge.a) else leftmost.edge.b
+        partial_edge = Edge(n, n, visible=leftmost.edge.visible)
+    output.part(partial_edge, leftmost.edge)
     new_node = Node(partial_edge)
 
-    edge1, edge2 = n.edges
-    if edge1 == leftmost.edge:
-        edge1 = partial_edge
-    else:
-        edge2 = partial_edge
-    n.edges = edge1, edge2
+    # the scene is shared between queries, so the partial edge replaces
+    # the original one only for the rest of this sweep (n is no vertex
+    # when the edge was split by the initial ray)
+    edges = vertex_edges(scene, overrides, n)
+    if edges:
+        overrides[n] = tuple(partial_edge if edge == leftmost.edge else edge for edge in edges)
 
     tree.update(old=leftmost, new=new_node, ray=ray)
 
@@ -141,44 +147,128 @@ def construct_begin_edge(output: [Edge], tree: Tree, vertices: [Point], ray: Ray
     output.append(new_edge)  
 
 
-def update_output(tree: Tree, output: [Edge], leftmost: Edge):
-    if leftmost and leftmost.edge not in output:
+def sweep_vertex(output: Output, tree: Tree, scene: Scene, overrides: dict, ray: Ray,
+                 edges: [Edge], active: [bool], leftmost: Node):
+    # vertices without exactly two edges to sweep: ends cut off by
+    # max_distance, shared vertices, edges along the ray
+    removed = [edge for edge, flag in zip(edges, active) if flag is True]
+    added = [edge for edge, flag in zip(edges, active) if flag is False]
+    for edge in removed:
+        delete(tree, edge, ray)
+    for edge in added:
+        insert(tree, edge, ray)
+
+    if tree.is_empty or leftmost == tree.leftmost:
+        return
+    was_removed = any(leftmost.edge is edge for edge in removed)
+    is_added = any(tree.leftmost.edge is edge for edge in added)
+    if was_removed and not is_added:
+        construct_begin_edge(output, tree, scene, overrides, ray)
+    elif is_added and not was_removed:
+        construct_end_edge(output, tree, leftmost, ray)
+
+
+def construct_sector_end(output: Output, tree: Tree, ray: Ray):
+    # cuts the leftmost edge at the closing boundary of a sector and
+    # returns to the viewpoint
+    leftmost = tree.leftmost
+    update_output(tree, output, leftmost)
+
+    z = output.cut(ray, leftmost.edge)
+    if z is None:
+        raise ValueError("No intersections")
+
+    cut_visible_part(output, leftmost.edge, z, ray)
+    output.append(Edge(z, ray.start, visible=False))
+
+
+def start_vertex(tree: Tree, edges: [Edge], active: [bool], ray: Ray):
+    # vertex on the initial ray: edges going ahead join the initial status,
+    # the ones coming from behind are swept last (or lie outside the sector)
+    for edge, flag in zip(edges, active):
+        if flag is False:
+            insert(tree, edge, ray)
+
+
+def update_output(tree: Tree, output: Output, leftmost: Node):
+    # an edge cut down to one end on the ray has nothing to show
+    if leftmost and leftmost.edge not in output and leftmost.edge.a is not leftmost.edge.b:
         output.append(leftmost.edge)
 
 
-def asano_algorithm(point: Point, polygons: [Polygon]):
-    polygons = add_bounds(point, polygons)
-    ray = get_initial_ray(point, polygons)
-    edges, first = sort_edges(ray, polygons)
-    tree = init_tree(edges, ray)
-    vertices = sort_vertices(point, first, polygons)
+def sweep(point: Point, polygons: [Polygon], tree_class=Tree, max_distance=None, fov=None) -> Output:
+    scene = get_scene(point, polygons, max_distance)
+    if fov is not None and fov[1] < 2 * pi:
+        ray, end_ray = get_sector_rays(point, scene, fov)
+    else:
+        ray, end_ray = get_initial_ray(point, scene), None
+    return sweep_scene(scene, ray, end_ray, tree_class)
+
+
+def sweep_scene(scene: Scene, ray: Ray, end_ray: Ray = None, tree_class=Tree, events=None, output=None,
+                status=None) -> Output:
+    """
+    Sweeps around ray.start from `ray` up to `end_ray`, or all the way
+    round without one. `events` may give the vertices already sorted by
+    sort_events and `output` may be a tracing Output.
 
-    output = []
-    for vertex in vertices:
-       
-        edge1, edge2 = vertex.edges
-        ray = Ray(point, vertex)
+    A `status` list, with a tracing output, receives (vertex, edge) for
+    every swept vertex, edge being the scene edge nearest the point past
+    it, leftmost in the status.
+    """
+    point = ray.start
+    output = output if output is not None else Output()
+    tree, overrides = initial_status(ray, scene, tree_class, output)
+    if events is None:
+        limit = None if end_ray is None else get_pseudo_angle(point, ray.end, end_ray.end)
+        events = sort_events(point, ray.end, scene, limit)
+
+    start = 0
+    while start < len(events) and on_ray(ray, events[start][0]):
+        vertex, active = events[start]
+        start_vertex(tree, vertex_edges(scene, overrides, vertex), active, RayOrder(Ray(point, vertex)))
+        start += 1
+
+    def record(vertex):
+        if status is not None:
+            status.append((vertex, output.origin(tree.leftmost.edge)))
+
+    if end_ray is not None:
+        output.append(Edge(point, output.cut(ray, tree.leftmost.edge), visible=False))
+
+    previous = None
+    for vertex, active in events[start:]:
+        if previous is not None:
+            record(previous)
+        previous = vertex
+
+        edges = vertex_edges(scene, overrides, vertex)
+        # one comparison context per event: each edge is intersected once
+        ray = RayOrder(Ray(point, vertex))
         leftmost = tree.leftmost
         update_output(tree, output, leftmost)
 
-        if (is_active_edge(point, vertex, edge1) and is_active_edge(point, vertex, edge2)):
+        if len(edges) != 2 or None in active:
+            sweep_vertex(output, tree, scene, overrides, ray, edges, active, leftmost)
+            continue
+
+        (edge1, edge2), (active1, active2) = edges, active
+        if active1 and active2:
             
             delete(tree, edge1, ray)
             delete(tree, edge2, ray)
             if not tree.is_empty and leftmost != tree.leftmost:
-                construct_begin_edge(output, tree, vertices, ray)
+                construct_begin_edge(output, tree, scene, overrides, ray)
                 #construct_edge(output, tree, tree.leftmost, ray)
             continue
 
-        elif (is_active_edge(point, vertex, edge1) ^ is_active_edge(point, vertex, edge2)):
+        elif active1 ^ active2:
             
-            active, not_active = edge1, edge2
-            if not is_active_edge(point, vertex, edge1):
-                active, not_active = edge2, edge1
+            active, not_active = (edge1, edge2) if active1 else (edge2, edge1)
             update(tree, active, not_active, ray)
             continue
             
-        elif (not is_active_edge(point, vertex, edge1) and not is_active_edge(point, vertex, edge2)):
+        else:
             
             first, second = (edge1, edge2) if is_closer(edge1, edge2, ray) else (edge2, edge1)
 
@@ -189,12 +279,32 @@ def asano_algorithm(point: Point, polygons: [Polygon]):
                 construct_end_edge(output, tree, leftmost, ray)
                 #construct_edge(output, tree, leftmost, ray)
 
-    update_output(tree, output, leftmost)
-    return output 
+    if previous is not None:
+        record(previous)
+    if end_ray is not None:
+        construct_sector_end(output, tree, end_ray)
+    else:
+        update_output(tree, output, tree.leftmost)
+    return output
+
+
+def asano_algorithm(point: Point, polygons: [Polygon], tree_class=Tree, max_distance=None, fov=None) -> [Edge]:
+    # fov=(heading, angle) in radians limits the sweep to that cone of vision
+    return list(sweep(point, polygons, tree_class, max_distance, fov))
+
+
+def visibility_polygon(point: Point, polygons: [Polygon], tree_class=Tree, max_distance=None, fov=None):
+    # ordered vertices of the visibility polygon and Edge.visible of each side
+    return sweep(point, polygons, tree_class, max_distance, fov).ring()
+
+
+def visibility_region(point: Point, polygons: [Polygon], tree_class=Tree, max_distance=None, fov=None) -> VisibilityRegion:
+    # the visibility polygon indexed for "can the viewer see this point" queries
+    return VisibilityRegion(point, *visibility_polygon(point, polygons, tree_class, max_distance, fov))
 
 if __name__ == "__main__":
 
-    from tree_ import Tree, Node
+    from tree import Tree, Node
     
     polygons = [
         Polygon([
@@ -216,3 +326,29 @@ if __name__ == "__main__":
     point = Point(50, 50)
     edges = asano_algorithm(point, polygons)
    
+
+    # regression: viewpoints in line with rows of vertices and along the
+    # sides of the squares, against the triangular expansion
+    from expansion import expansion_polygon
+
+    def area(ring):
+        x, y = ring[:, 0], ring[:, 1]
+        return 0.5 * float(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+    squares = [Polygon([Point(20 + 20 * i, 20 + 20 * j), Point(30 + 20 * i, 20 + 20 * j),
+                        Point(30 + 20 * i, 30 + 20 * j), Point(20 + 20 * i, 30 + 20 * j)])
+               for i in range(5) for j in range(5)]
+    scene = Scene(squares, [Point(0, 0), Point(130, 130)])
+    checked, wrong = 0, []
+    for x in range(0, 131, 2):
+        for y in range(0, 131, 2):
+            point = Point(x, y)
+            try:
+                expected = area(expansion_polygon(point, scene)[0])
+            except ValueError:
+                # on a side or a vertex of a square
+                continue
+            checked += 1
+            if abs(area(visibility_polygon(point, scene)[0]) - expected) > 1e-9 * expected:
+                wrong.append((x, y))
+    print(f"lattice: {checked} viewpoints, wrong {len(wrong)} {wrong[:5]}")
@@ -1,10 +1,14 @@
 from math import sqrt
 from math import atan, pi, sin, cos, degrees
 import sys
+from predicates import orientation, side, on_ray
 eps = 10e-5
 
 
 def is_closer(first: 'Edge', second: 'Edge', ray: 'Ray'):
+    if isinstance(ray, RayOrder):
+        return ray.closer(first, second)
+
     intersection1 = ray.intersect(first)
     intersection2 = ray.intersect(second)
 
@@ -46,6 +50,21 @@ def get_angle(a, b, c):
     c = move(c, a)
     return polar_angle(rotate(c, -polar_angle(b)))
 
+
+def pseudo_angle(x, y):
+    # monotone in the polar angle of (x, y): 0, 1, 2, 3 at 0, pi/2, pi, 3pi/2
+    total = abs(x) + abs(y)
+    if total == 0:
+        return 0.0
+    return 3 + x / total if y < 0 else 1 - x / total
+
+
+def get_pseudo_angle(a, b, c):
+    # orders points like get_angle(a, b, c), without trigonometry
+    bx, by = b.x - a.x, b.y - a.y
+    cx, cy = c.x - a.x, c.y - a.y
+    return pseudo_angle(bx * cx + by * cy, bx * cy - by * cx)
+
 def det2(a, b, c, d):
     return a * d - b * c
 
@@ -56,14 +75,10 @@ def elipse_box(p, d=4):
 
 
 class Point:
+    __slots__ = ("x", "y")
+
     def __init__(self, x: float, y: float):
         self.x, self.y = x, y
-        self.edges = set()
-
-    def add_edge(self, edge: 'Edge'):
-        if len(self.edges) == 2: 
-            raise ValueError("Strange situation, becouse vertex can have only two points")
-        self.edges.add(edge)
 
     @property
     def coordinates(self):
@@ -88,6 +103,8 @@ class Point:
 
 
 class Edge:
+    __slots__ = ("a", "b", "visible")
+
     def __init__(self, a: Point, b: Point, visible: bool = True):
         self.a, self.b = a, b
         self.visible = visible
@@ -97,13 +114,15 @@ class Edge:
         return Point((a.x + b.x) / 2, (a.y + b.y) / 2)
 
     def contains(self, point: Point):
+        return self.contains_xy(point.x, point.y)
+
+    def contains_xy(self, x: float, y: float):
+        # bounding box with eps slack, which also covers points equal to an end
         a, b = self.a, self.b
-        # todo: epsilon for equals
-        return ((   max(a.x, b.x) >= point.x 
-                and min(a.x, b.x) <= point.x
-                and max(a.y, b.y) >= point.y 
-                and min(a.y, b.y) <= point.y) 
-            or ((a == point) or (b == point)))
+        return (    max(a.x, b.x) + eps >= x 
+                and min(a.x, b.x) - eps <= x
+                and max(a.y, b.y) + eps >= y 
+                and min(a.y, b.y) - eps <= y)
 
     def __repr__(self):
         return str(self)    
@@ -132,12 +151,18 @@ class Edge:
         return None
 
 class Ray:
+    __slots__ = ("start", "end")
+
     def __init__(self, start: Point, end: Point):
         self.start, self.end = start, end
 
     def contains(self, point: Point):
-        max_dist = max(self.start.dist(point), self.start.dist(self.end))
-        between = point.dist(self.end)
+        return self.contains_xy(point.x, point.y)
+
+    def contains_xy(self, x: float, y: float):
+        start, end = self.start, self.end
+        max_dist = max(sqrt((x - start.x) ** 2 + (y - start.y) ** 2), start.dist(end))
+        between = sqrt((x - end.x) ** 2 + (y - end.y) ** 2)
         return max_dist >= between
 
     def intersect(self, edge: Edge):
@@ -146,28 +171,109 @@ class Ray:
         x3, y3 = edge.a.coordinates
         x4, y4 = edge.b.coordinates
         d = (x1 - x2) * (y3 - y4) - (y1 - y2) * (x3 - x4)
-        if d == 0: 
-            return None
+        if d == 0:
+            return self.touch(edge)
         x = ((x1 * y2 - y1 * x2) * (x3 - x4) - (x1 - x2) * (x3 * y4 - y3 * x4)) / d
         y = ((x1 * y2 - y1 * x2) * (y3 - y4) - (y1 - y2) * (x3 * y4 - y3 * x4)) / d
-        p = Point(x, y)
-        
-        if (not edge.contains(p)) or (not self.contains(p)):
+        if (not edge.contains_xy(x, y)) or (not self.contains_xy(x, y)):
+            return self.touch(edge)
+        return Point(x, y)
+
+    def touch(self, edge: Edge):
+        # exact fallback for the edges the formula above can't cut: parallel,
+        # cut down to a point or shorter than its rounding error. An end on
+        # the ray is the cut, the nearest one if both are; an edge the ray
+        # separates is cut along its own length, accurate however short it is
+        ends = [end for end in (edge.a, edge.b) if on_ray(self, end)]
+        if ends:
+            end = min(ends, key=self.start.dist)
+            return Point(end.x, end.y)
+        a, b, start = edge.a, edge.b, self.start
+        rx, ry = self.end.x - start.x, self.end.y - start.y
+        if a == b:
+            # a crossing that rounded onto or next to a vertex: a cut within eps of the ray
+            dx, dy = a.x - start.x, a.y - start.y
+            near = abs(rx * dy - ry * dx) <= eps * sqrt(rx * rx + ry * ry)
+            return Point(a.x, a.y) if near and rx * dx + ry * dy > 0 else None
+        if side(self, a) * side(self, b) >= 0:
             return None
-        return p
-        
+        ex, ey = b.x - a.x, b.y - a.y
+        t = ((start.x - a.x) * ry - (start.y - a.y) * rx) / (ex * ry - ey * rx)
+        t = min(max(t, 0.0), 1.0)
+        x, y = a.x + t * ex, a.y + t * ey
+        return Point(x, y) if self.contains_xy(x, y) else None
+
     def intersect_dist(self, edge: Edge):
         if not self.intersect(edge):
             raise ValueError("No intersections")
         return self.start.dist(self.intersect(edge))
 
+class RayOrder:
+    """
+    Comparison context for one sweep event. Stands in for its Ray, but
+    intersects every edge with the ray at most once and remembers how the
+    edges sharing an end on the ray are ordered.
+    """
+    __slots__ = ("ray", "start", "end", "hits", "ties")
+
+    def __init__(self, ray: Ray):
+        self.ray = ray
+        self.start, self.end = ray.start, ray.end
+        # id(edge) -> (edge, hit point, distance); keeping the edge keeps its id unique
+        self.hits = {}
+        self.ties = {}
+
+    def hit(self, edge: Edge):
+        hit = self.hits.get(id(edge))
+        if hit is None:
+            point = self.ray.intersect(edge)
+            dist = None if point is None else self.start.dist(point)
+            hit = self.hits[id(edge)] = (edge, point, dist)
+        return hit
+
+    def intersect(self, edge: Edge):
+        return self.hit(edge)[1]
+
+    def intersect_dist(self, edge: Edge):
+        dist = self.hit(edge)[2]
+        if dist is None:
+            raise ValueError("No intersections")
+        return dist
+
+    def closer(self, first: Edge, second: Edge):
+        _, intersection1, dist1 = self.hit(first)
+        _, intersection2, dist2 = self.hit(second)
+
+        if not intersection1 or not intersection2:
+            raise ValueError("Can't find closer edge")
+
+        if intersection1 == intersection2:
+            key = id(first), id(second)
+            if key not in self.ties:
+                self.ties[key] = self.tie(first, second, intersection1)
+            return self.ties[key]
+
+        return dist1 < dist2
+
+    def tie(self, first: Edge, second: Edge, z: Point):
+        # both edges leave z; first is closer if it runs inside the angle
+        # between second and the direction back to the ray start
+        first_other = max(first.a, first.b, key=z.dist)
+        second_other = max(second.a, second.b, key=z.dist)
+        start = self.start
+        side = orientation(z.x, z.y, second_other.x, second_other.y, start.x, start.y)
+        return (orientation(z.x, z.y, second_other.x, second_other.y, first_other.x, first_other.y) * side > 0
+                and orientation(z.x, z.y, first_other.x, first_other.y, start.x, start.y) * side > 0)
+
+
+def ray_order(ray):
+    return ray if isinstance(ray, RayOrder) else RayOrder(ray)
+
+
 class Polygon:
     def __init__(self, points: [Point], visible=True):
         self.points = points
         self.visible = visible
-        for edge in self.edges:
-            edge.a.add_edge(edge)
-            edge.b.add_edge(edge)
 
     @property
     def edges(self):